@@ -0,0 +1,74 @@
+"""
+Per-block activation checkpointing for ResNet3D and its LSTM variant.
+
+`layer1` and `layer2` run 64- and 128-channel convolutions at full resolution and
+keep the time dimension. Their conv, BatchNorm, LeakyReLU and dropout outputs dominate
+what autograd stores for backward. A checkpointed block keeps only its input and
+recomputes the block during backward, trading one extra forward of the block for its
+activations.
+
+The recompute must not update the BatchNorm running statistics a second time. While a
+block is recomputed, its BatchNorm layers run with momentum 0, so they still normalize
+with the batch statistics, exactly as in the original forward, and save the same
+tensors for backward, but the running mean and variance stay as they were. The batch
+count is restored afterwards. Dropout masks match, because torch.utils.checkpoint
+restores the RNG state.
+
+    model = ResNet3D(num_classes=6, checkpoint_blocks=parse_checkpoint_blocks("early"))
+"""
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+import torch
+from torch.nn.modules.batchnorm import _BatchNorm
+from torch.utils.checkpoint import checkpoint
+
+BLOCKS = ("layer1", "layer2", "layer3", "layer4", "layer5")
+CHECKPOINT_PRESETS = {
+    "none": (),
+    "early": ("layer1", "layer2"),  # The full-resolution blocks, most of the activation memory
+    "all": BLOCKS,
+}
+
+
+def parse_checkpoint_blocks(spec):
+    """
+    Blocks to checkpoint from a preset ("none", "early", "all") or a comma-separated list
+    such as "layer1,layer3".
+    """
+    if spec in CHECKPOINT_PRESETS:
+        return CHECKPOINT_PRESETS[spec]
+    blocks = tuple(name.strip() for name in spec.split(",") if name.strip())
+    unknown = [name for name in blocks if name not in BLOCKS]
+    if unknown:
+        raise ValueError(f"Unknown blocks {unknown}, expected a preset {tuple(CHECKPOINT_PRESETS)} or names from {BLOCKS}.")
+    return blocks
+
+
+@contextmanager
+def frozen_batchnorm_stats(module):
+    """Run the BatchNorm layers of `module` without changing their running statistics."""
+    layers = [m for m in module.modules() if isinstance(m, _BatchNorm) and m.track_running_stats]
+    saved = [(layer.momentum, layer.num_batches_tracked.clone()) for layer in layers]
+    for layer in layers:
+        # running = (1 - 0) * running + 0 * batch leaves the buffers bit for bit unchanged
+        layer.momentum = 0.0
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for layer, (momentum, num_batches_tracked) in zip(layers, saved):
+                layer.momentum = momentum
+                layer.num_batches_tracked.copy_(num_batches_tracked)
+
+
+def _contexts(block):
+    # (context of the original forward, context of the recompute during backward)
+    return nullcontext(), frozen_batchnorm_stats(block)
+
+
+def run_block(block, x, checkpointed=False):
+    """`block(x)`, checkpointed if requested and the block is training with gradients enabled."""
+    if not (checkpointed and block.training and torch.is_grad_enabled()):
+        return block(x)
+    return checkpoint(block, x, use_reentrant=False, context_fn=partial(_contexts, block))
@@ -0,0 +1,109 @@
+"""
+Batched, stack-consistent augmentation for [B, 1, T, H, W] frame stacks.
+
+This replaces the per-frame PIL pipeline of the training scripts
+(RandomRotation -> GaussianBlur -> ToTensor -> add_noise, applied to each of the
+20 frames separately in a DataLoader worker). Every stack gets one random rotation
+and one blur sigma shared by all of its frames, the blur is separable, and the whole
+batch is processed with tensor ops, so it can run in the main process or on the
+training device.
+"""
+import math
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from collate import normalize_frames
+
+
+def gaussian_kernels(sigma, kernel_size):
+    """
+    Normalized 1D Gaussian kernels, one per sigma.
+
+    Args:
+        sigma (torch.Tensor): Standard deviations [N].
+        kernel_size (int): Odd kernel length.
+
+    Returns:
+        torch.Tensor: Kernels [N, kernel_size].
+    """
+    half = (kernel_size - 1) * 0.5
+    x = torch.linspace(-half, half, kernel_size, device=sigma.device, dtype=sigma.dtype)
+    kernels = torch.exp(-0.5 * (x[None, :] / sigma[:, None]) ** 2)
+    return kernels / kernels.sum(dim=1, keepdim=True)
+
+
+class StackAugment(nn.Module):
+    """
+    Random rotation, Gaussian blur and additive noise applied per stack.
+
+    Inputs are already at the model's input scale (collate.INPUT_SCALE), as
+    `to_model_input` delivers them; uint8 stacks are normalized the same way. Rotation
+    and blur are linear, so only the noise depends on the scale. The defaults reproduce
+    the distribution of the per-frame `train_transforms`: add_noise's std of 0.5 after
+    ToTensor becomes 0.5 / 255 after the dataset's division by 255.
+
+    Args:
+        degrees (float): Rotation angle is drawn from U(-degrees, degrees).
+        kernel_size (int): Blur kernel size.
+        sigma (tuple): Blur sigma is drawn from U(sigma[0], sigma[1]).
+        noise_std (float): Standard deviation of the additive Gaussian noise, at the input scale.
+        interpolation (str): "nearest" (as RandomRotation) or "bilinear".
+    """
+
+    def __init__(self, degrees=10.0, kernel_size=15, sigma=(0.5, 2.5), noise_std=0.5 / 255.0,
+                 interpolation="nearest"):
+        super(StackAugment, self).__init__()
+        self.degrees = degrees
+        self.kernel_size = kernel_size
+        self.sigma = sigma
+        self.noise_std = noise_std
+        self.interpolation = interpolation
+
+    def rotate(self, frames, angles):
+        # frames: [B, N, H, W]; every channel of a sample shares the same affine grid
+        _, _, height, width = frames.shape
+        cos, sin = torch.cos(angles), torch.sin(angles)
+        theta = torch.zeros(frames.shape[0], 2, 3, device=frames.device, dtype=frames.dtype)
+        theta[:, 0, 0] = cos
+        theta[:, 0, 1] = -sin * height / width
+        theta[:, 1, 0] = sin * width / height
+        theta[:, 1, 1] = cos
+        grid = F.affine_grid(theta, list(frames.shape), align_corners=False)
+        return F.grid_sample(frames, grid, mode=self.interpolation, padding_mode="zeros", align_corners=False)
+
+    def blur(self, frames, sigma):
+        # Separable blur with one kernel per sample, run as a grouped convolution
+        batch, channels, height, width = frames.shape
+        kernels = gaussian_kernels(sigma, self.kernel_size).repeat_interleave(channels, dim=0)
+        pad = self.kernel_size // 2
+        x = frames.reshape(1, batch * channels, height, width)
+        x = F.pad(x, (pad, pad, 0, 0), mode="reflect")
+        x = F.conv2d(x, kernels[:, None, None, :], groups=batch * channels)
+        x = F.pad(x, (0, 0, pad, pad), mode="reflect")
+        x = F.conv2d(x, kernels[:, None, :, None], groups=batch * channels)
+        return x.reshape(batch, channels, height, width)
+
+    @torch.no_grad()
+    def forward(self, x):
+        """
+        Args:
+            x (torch.Tensor): Frame stacks [B, C, T, H, W], uint8 or normalized float.
+
+        Returns:
+            torch.Tensor: Augmented stacks with the same shape.
+        """
+        if not x.is_floating_point():
+            x = normalize_frames(x)
+        batch, channels, frames, height, width = x.shape
+        stacks = x.reshape(batch, channels * frames, height, width)
+
+        angles = (torch.rand(batch, device=x.device, dtype=x.dtype) * 2 - 1) * math.radians(self.degrees)
+        stacks = self.rotate(stacks, angles)
+
+        sigma = torch.empty(batch, device=x.device, dtype=x.dtype).uniform_(*self.sigma)
+        stacks = self.blur(stacks, sigma)
+
+        stacks = stacks + torch.randn_like(stacks) * self.noise_std
+        return stacks.reshape(batch, channels, frames, height, width)
@@ -0,0 +1,142 @@
+"""
+Find the largest micro-batch whose training step fits in memory.
+
+Conv3d activations at T=20 dominate training memory, and they grow linearly with the
+batch. `step_memory` measures one forward/backward step of a model:
+- On CUDA it reads the allocator's peak (torch.cuda.max_memory_allocated).
+- On the CPU there is no allocator counter. `LiveMemoryTracker`, a dispatch mode, follows
+  every storage the step creates until it is freed, and records the peak. This also
+  covers activations that checkpointed blocks recompute during backward.
+
+`max_micro_batch` measures batches of 1 and 2, fits memory = fixed + per_sample * batch
+and solves for the budget. The budget defaults to 90% of the free GPU memory, or half of
+the available host memory on the CPU. Parameters, gradients and optimizer state are
+counted separately. On CUDA the candidate is then run for real, and stepped down until
+it fits.
+
+    batch_size = max_micro_batch(model, (20, 64, 64), device)
+"""
+import itertools
+import os
+
+import torch
+from torch.multiprocessing.reductions import StorageWeakRef
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_leaves
+
+from execution import warm_up
+
+
+class LiveMemoryTracker(TorchDispatchMode):
+    """
+    Peak bytes of storages produced by the operators run inside the context and still alive.
+
+    Storages are keyed by `untyped_storage().data_ptr()`, so views and aliases count once.
+    Storages whose pointer is in `exclude`, such as parameters and buffers that
+    `static_bytes` already counts, are never tracked, and neither are their views.
+    """
+
+    def __init__(self, exclude=()):
+        super().__init__()
+        self.exclude = set(exclude)
+        self.storages = {}
+        self.peak = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        live = 0
+        for key, (ref, nbytes) in list(self.storages.items()):
+            if ref.expired():
+                del self.storages[key]
+            else:
+                live += nbytes
+        for tensor in tree_leaves(out):
+            if isinstance(tensor, torch.Tensor):
+                storage = tensor.untyped_storage()
+                if storage.data_ptr() not in self.storages and storage.data_ptr() not in self.exclude:
+                    self.storages[storage.data_ptr()] = (StorageWeakRef(storage), storage.nbytes())
+                    live += storage.nbytes()
+        self.peak = max(self.peak, live)
+        return out
+
+
+def _param_bytes(model):
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def static_bytes(model, optimizer_slots=1):
+    """Memory of parameters, gradients and `optimizer_slots` state tensors per parameter (1 for SGD with momentum)."""
+    return _param_bytes(model) * (2 + optimizer_slots)
+
+
+def default_budget(device):
+    """Bytes a training step may use on `device`."""
+    device = torch.device(device)
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return int((free + torch.cuda.memory_allocated(device)) * 0.9)
+    available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    return int(available * 0.5)
+
+
+def step_memory(model, batch_size, sample_shape, device, precision=None, channels_last=False):
+    """
+    Peak memory of one training step beyond what was allocated before it, in bytes.
+
+    Args:
+        sample_shape (tuple): (frames, H, W) of one stack.
+
+    The step goes through `execution.warm_up`, so BatchNorm statistics and gradients are
+    left as they were. Parameters, buffers and gradients are counted by `static_bytes`,
+    so they are allocated before the measurement and not charged to the step.
+    """
+    device = torch.device(device)
+    input_shape = (batch_size, 1) + tuple(sample_shape)
+    for param in model.parameters():
+        if param.requires_grad and param.grad is None:
+            param.grad = torch.zeros_like(param)  # Backward accumulates into it in place
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = torch.cuda.memory_allocated(device)
+        warm_up(model, input_shape, device, precision, train=True, channels_last=channels_last)
+        return torch.cuda.max_memory_allocated(device) - baseline
+
+    static = itertools.chain(model.parameters(), model.buffers(), (p.grad for p in model.parameters() if p.grad is not None))
+    tracker = LiveMemoryTracker(exclude={t.untyped_storage().data_ptr() for t in static})
+    with tracker:
+        warm_up(model, input_shape, device, precision, train=True, channels_last=channels_last)
+    return tracker.peak
+
+
+def max_micro_batch(model, sample_shape, device, precision=None, channels_last=False, budget=None,
+                    optimizer_slots=1, limit=1024):
+    """
+    Largest micro-batch (at least 1, at most `limit`) whose training step fits `budget` bytes.
+
+    Args:
+        model: Model on `device`, in the execution format it is trained in.
+        sample_shape (tuple): (frames, H, W) of one stack.
+        budget (int): Bytes available for the step (default: `default_budget`).
+        optimizer_slots (int): Optimizer state tensors per parameter.
+    """
+    device = torch.device(device)
+    budget = default_budget(device) if budget is None else budget
+    available = budget - static_bytes(model, optimizer_slots)
+    one = step_memory(model, 1, sample_shape, device, precision, channels_last)
+    two = step_memory(model, 2, sample_shape, device, precision, channels_last)
+    per_sample = max(two - one, 1)
+    fixed = max(one - per_sample, 0)
+    batch = int(max(1, min(limit, (available - fixed) // per_sample)))
+
+    if device.type == "cuda":
+        # Confirm on the device; fragmentation and workspace can cost more than the fit predicts
+        while batch > 1:
+            try:
+                if step_memory(model, batch, sample_shape, device, precision, channels_last) <= available:
+                    break
+            except torch.cuda.OutOfMemoryError:
+                pass
+            torch.cuda.empty_cache()
+            batch = max(1, int(batch * 0.9))
+    return batch
@@ -0,0 +1,80 @@
+"""
+Compare the throughput of the per-frame PIL augmentation with the batched StackAugment.
+
+The per-frame path is the `train_transforms` pipeline of the training scripts applied
+to every frame of every stack, followed by the conversion StackedFramesDataset does.
+The batched path runs StackAugment on a uint8 [B, 1, T, H, W] batch, on CPU and, when
+available, on CUDA.
+
+Usage:
+    python -m benchmarks.bench_augment --batch-size 4 --frames 20
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from augment import StackAugment
+from resnet_predictaverage import add_noise
+
+
+def per_frame(frames, transform):
+    # frames: uint8 [B, T, H, W]
+    stacks = []
+    for stack in frames:
+        images = []
+        for pixels in stack:
+            image = transform(Image.fromarray(pixels))
+            images.append(torch.from_numpy(np.array(image, dtype=np.float32) / 255.0).unsqueeze(0))
+        stacks.append(torch.stack(images, dim=0))
+    return torch.stack(stacks, dim=0)
+
+
+def timed(fn, repeats, sync=None):
+    fn()
+    if sync:
+        sync()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if sync:
+        sync()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    train_transforms = transforms.Compose([
+        transforms.RandomRotation(degrees=10),
+        transforms.GaussianBlur(kernel_size=(15, 15), sigma=(0.5, 2.5)),
+        transforms.ToTensor(),
+        transforms.Lambda(add_noise)
+    ])
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, size=(args.batch_size, args.frames, args.size, args.size), dtype=np.uint8)
+    batch = torch.from_numpy(frames).unsqueeze(1)
+    augment = StackAugment()
+    num_frames = args.batch_size * args.frames
+
+    results = [("per-frame PIL (1 worker)", timed(lambda: per_frame(frames, train_transforms), args.repeats))]
+    results.append(("StackAugment cpu", timed(lambda: augment(batch), args.repeats)))
+    if torch.cuda.is_available():
+        gpu_batch = batch.cuda()
+        results.append(("StackAugment cuda", timed(lambda: augment(gpu_batch), args.repeats, torch.cuda.synchronize)))
+
+    print(f"{'path':<26} {'ms/batch':>10} {'frames/s':>12}")
+    for name, seconds in results:
+        print(f"{name:<26} {seconds * 1e3:>10.2f} {num_frames / seconds:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Training throughput and activation memory against micro-batch size.
+
+For each model and micro-batch size, the benchmark times SGD steps on synthetic stacks.
+Each step is a forward pass under Precision.autocast, an MSE backward and a clipped
+step. It reports samples/s, the peak memory of a step (see batch_probe.step_memory)
+and the largest micro-batch that fits the memory budget. Pair a micro-batch with
+--accumulate in the training scripts to reach the effective batch you want.
+
+Usage:
+    python -m benchmarks.bench_batch --models resnet lstm --batch-sizes 1 2 4 8 --size 64
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from batch_probe import default_budget, max_micro_batch, step_memory
+from precision import PRECISIONS, Precision
+
+
+def build_model(name, num_outputs):
+    if name == "lstm":
+        from resnet_predictaverage_LSTM import ResNet3D, initialize_weights
+    else:
+        from resnet_predictaverage import ResNet3D, initialize_weights
+    model = ResNet3D(num_classes=num_outputs, dropout_prob=0.0)
+    model.apply(initialize_weights)
+    return model
+
+
+def samples_per_second(model, batch_size, args, device, precision):
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9)
+    criterion = nn.MSELoss()
+    inputs = torch.rand(batch_size, 1, args.frames, args.size, args.size, device=device)
+    labels = torch.randn(batch_size, args.outputs, device=device)
+
+    def step():
+        optimizer.zero_grad()
+        with precision.autocast():
+            predictions = model(inputs)
+        loss = criterion(predictions.float(), labels)
+        precision.backward(loss)
+        precision.step(optimizer, model.parameters(), max_norm=1.0)
+        return loss
+
+    step()  # Warm-up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        loss = step()
+    loss.item()
+    return args.steps * batch_size / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=["resnet", "lstm"], default=["resnet", "lstm"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--outputs", type=int, default=6)
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument("--memory-budget-mb", type=float, default=0, help="Default: batch_probe.default_budget")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    precision = Precision(args.precision, device)
+    budget = int(args.memory_budget_mb * 2**20) or default_budget(device)
+    sample_shape = (args.frames, args.size, args.size)
+    print(f"Memory budget: {budget / 2**20:.0f} MB")
+    for name in args.models:
+        torch.manual_seed(0)
+        model = build_model(name, args.outputs).to(device)
+        largest = max_micro_batch(model, sample_shape, device, precision, budget=budget)
+        print(f"\n{name}: largest micro-batch within budget = {largest}")
+        print(f"{'batch':>6} {'samples/s':>10} {'step MB':>15}")
+        for batch_size in args.batch_sizes:
+            if batch_size > largest:
+                print(f"{batch_size:>6} {'over budget':>10}")
+                continue
+            memory = step_memory(model, batch_size, sample_shape, device, precision)
+            print(f"{batch_size:>6} {samples_per_second(model, batch_size, args, device, precision):>10.1f} {memory / 2**20:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
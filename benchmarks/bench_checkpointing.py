@@ -0,0 +1,96 @@
+"""
+Step time and peak memory of activation checkpointing settings.
+
+For each model and `--activation-checkpointing` setting, the benchmark measures one
+training step at a fixed micro-batch: its peak memory (see batch_probe.step_memory),
+the largest micro-batch that fits the memory budget, and the time of an SGD step.
+Checkpointing trades step time for memory. The memory it frees goes into a larger
+micro-batch, or fewer --accumulate steps.
+
+Usage:
+    python -m benchmarks.bench_checkpointing --models resnet lstm --settings none early all --size 64
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from activation_checkpoint import parse_checkpoint_blocks
+from batch_probe import default_budget, max_micro_batch, step_memory
+from precision import PRECISIONS, Precision
+
+
+def build_model(name, num_outputs, checkpoint_blocks):
+    if name == "lstm":
+        from resnet_predictaverage_LSTM import ResNet3D, initialize_weights
+    else:
+        from resnet_predictaverage import ResNet3D, initialize_weights
+    model = ResNet3D(num_classes=num_outputs, dropout_prob=0.0, checkpoint_blocks=checkpoint_blocks)
+    model.apply(initialize_weights)
+    return model
+
+
+def step_seconds(model, args, device, precision):
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9)
+    criterion = nn.MSELoss()
+    inputs = torch.rand(args.batch_size, 1, args.frames, args.size, args.size, device=device)
+    labels = torch.randn(args.batch_size, args.outputs, device=device)
+
+    def step():
+        optimizer.zero_grad()
+        with precision.autocast():
+            predictions = model(inputs)
+        loss = criterion(predictions.float(), labels)
+        precision.backward(loss)
+        precision.step(optimizer, model.parameters(), max_norm=1.0)
+        return loss
+
+    step()  # Warm-up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        loss = step()
+    loss.item()
+    return (time.perf_counter() - start) / args.steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=["resnet", "lstm"], default=["resnet", "lstm"])
+    parser.add_argument("--settings", nargs="+", default=["none", "early", "all"],
+                        help="Presets or comma-separated block lists, as for --activation-checkpointing")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--outputs", type=int, default=6)
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument("--memory-budget-mb", type=float, default=0, help="Default: batch_probe.default_budget")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    precision = Precision(args.precision, device)
+    budget = int(args.memory_budget_mb * 2**20) or default_budget(device)
+    sample_shape = (args.frames, args.size, args.size)
+    print(f"Memory budget: {budget / 2**20:.0f} MB, micro-batch {args.batch_size}")
+    for name in args.models:
+        print(f"\n{name}")
+        print(f"{'setting':>24} {'step ms':>8} {'peak MB':>8} {'largest batch':>14}")
+        baseline = None
+        for setting in args.settings:
+            torch.manual_seed(0)
+            model = build_model(name, args.outputs, parse_checkpoint_blocks(setting)).to(device)
+            memory = step_memory(model, args.batch_size, sample_shape, device, precision)
+            largest = max_micro_batch(model, sample_shape, device, precision, budget=budget)
+            seconds = step_seconds(model, args, device, precision)
+            baseline = baseline or (seconds, memory)
+            print(f"{setting:>24} {seconds * 1e3:>8.1f} {memory / 2**20:>8.1f} {largest:>14}"
+                  f"  ({seconds / baseline[0]:.2f}x time, {memory / baseline[1]:.2f}x memory)")
+            del model
+
+
+if __name__ == '__main__':
+    main()
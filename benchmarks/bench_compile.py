@@ -0,0 +1,89 @@
+"""
+Training step time of ResNet3D in eager mode, channels_last_3d and torch.compile.
+
+For each configuration a freshly seeded model is prepared with execution.prepare_model
+and warmed up, which includes compilation. Then the benchmark times full training
+steps: forward, backward, clipping and an SGD step. The warm-up time shows what
+compilation costs a short run; run the benchmark twice to see the effect of the
+on-disk graph cache.
+
+Usage:
+    python -m benchmarks.bench_compile --steps 10 --batch-size 4 --model resnet
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from execution import prepare_model, to_memory_format, warm_up
+
+CONFIGS = {
+    "eager": dict(channels_last=False, compile=False),
+    "channels_last": dict(channels_last=True, compile=False),
+    "compile": dict(channels_last=False, compile=True),
+    "compile+channels_last": dict(channels_last=True, compile=True),
+}
+
+
+def build_model(name, num_outputs):
+    if name == "lstm":
+        from resnet_predictaverage_LSTM import ResNet3D, initialize_weights
+    else:
+        from resnet_predictaverage import ResNet3D, initialize_weights
+    model = ResNet3D(num_classes=num_outputs, dropout_prob=0.5)
+    model.apply(initialize_weights)
+    return model
+
+
+def run(config, args, device, inputs, labels):
+    torch.manual_seed(0)
+    model = build_model(args.model, args.outputs).to(device)
+    forward_model = prepare_model(model, compile_mode=args.compile_mode, **config)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9)
+    criterion = nn.MSELoss()
+    inputs = to_memory_format(inputs, config["channels_last"])
+
+    warm_up_time = warm_up(forward_model, inputs.shape, device, channels_last=config["channels_last"])
+    model.train()
+    times = []
+    for _ in range(args.steps):
+        start = time.perf_counter()
+        optimizer.zero_grad()
+        loss = criterion(forward_model(inputs), labels)
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+        optimizer.step()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    # The first timed step can still trigger guards or autotuning; report the median
+    return warm_up_time, sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["resnet", "lstm"], default="resnet")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--compile-mode", default="default")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--outputs", type=int, default=6)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    generator = torch.Generator().manual_seed(0)
+    inputs = torch.rand(args.batch_size, 1, args.frames, args.size, args.size, generator=generator).to(device)
+    labels = torch.randn(args.batch_size, args.outputs, generator=generator).to(device)
+
+    print(f"{'config':<22} {'warm-up s':>10} {'ms/step':>10} {'samples/s':>10}")
+    for name in args.configs:
+        warm_up_time, step_time = run(CONFIGS[name], args, device, inputs, labels)
+        print(f"{name:<22} {warm_up_time:>10.1f} {step_time * 1e3:>10.1f} {args.batch_size / step_time:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark the window lookup of StackedFramesDataset as the number of sequences grows.
+
+Only the index -> (sequence, frame) mapping is timed, so no images are read. The
+legacy linear scan is reproduced here for comparison.
+
+Usage:
+    python -m benchmarks.bench_dataset_index
+"""
+import argparse
+import time
+
+import numpy as np
+
+from resnet_predictaverage import StackedFramesDataset
+
+
+def make_dataset(num_sequences, frames_per_sequence=300, frames_per_stack=20, seed=0):
+    # Build the dataset in memory without touching the file system
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(frames_per_sequence // 2, frames_per_sequence * 2, size=num_sequences)
+    dataset = StackedFramesDataset.__new__(StackedFramesDataset)
+    dataset.root_dir = None
+    dataset.transform = None
+    dataset.frames_per_stack = frames_per_stack
+    dataset.data = [(range(n), np.zeros((n, 11))) for n in lengths]
+    dataset._build_index()
+    return dataset
+
+
+def linear_locate(dataset, idx):
+    # The lookup StackedFramesDataset.__getitem__ used before the offset index
+    for seq_idx, (frames, _) in enumerate(dataset.data):
+        num_stacks = len(frames) - dataset.frames_per_stack
+        if idx < num_stacks:
+            return seq_idx, idx
+        idx -= num_stacks
+    raise IndexError("Index out of range.")
+
+
+def time_lookups(locate, dataset, queries):
+    start = time.perf_counter()
+    for idx in queries:
+        locate(dataset, idx)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    print(f"{'sequences':>10} {'windows':>10} {'linear (us)':>12} {'bisect (us)':>12} {'len linear (us)':>16} {'len cached (us)':>16}")
+    for size in args.sizes:
+        dataset = make_dataset(size)
+        queries = rng.integers(0, len(dataset), size=args.queries).tolist()
+        linear = time_lookups(linear_locate, dataset, queries)
+        bisect = time_lookups(StackedFramesDataset._locate, dataset, queries)
+
+        start = time.perf_counter()
+        for _ in range(100):
+            sum(len(frames) - dataset.frames_per_stack for frames, _ in dataset.data)
+        len_linear = (time.perf_counter() - start) / 100
+        start = time.perf_counter()
+        for _ in range(100):
+            len(dataset)
+        len_cached = (time.perf_counter() - start) / 100
+
+        print(f"{size:>10} {len(dataset):>10} {linear * 1e6:>12.2f} {bisect * 1e6:>12.2f} {len_linear * 1e6:>16.2f} {len_cached * 1e6:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
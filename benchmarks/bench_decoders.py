@@ -0,0 +1,72 @@
+"""
+Frames per second of each image decoder backend, and whether it matches PIL exactly.
+
+Runs on frames from a training tree if one is given, otherwise on synthetic 64x64
+JPEGs written to a temporary folder.
+
+Usage:
+    python -m benchmarks.bench_decoders --root-dir TrainingData2/ --frames 2000
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from decoders import benchmark_decoders, select_decoder
+from frame_store import list_frames
+
+
+def tree_frames(root_dir, limit):
+    paths = []
+    for subject in sorted(os.listdir(root_dir)):
+        subject_path = os.path.join(root_dir, subject)
+        if not os.path.isdir(subject_path):
+            continue
+        for sequence in sorted(os.listdir(subject_path)):
+            sequence_path = os.path.join(subject_path, sequence)
+            if os.path.isdir(sequence_path):
+                paths.extend(os.path.join(sequence_path, name) for name in list_frames(sequence_path))
+            if len(paths) >= limit:
+                return paths[:limit]
+    return paths
+
+
+def synthetic_frames(folder, count, size):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        # Smooth RGB content, closer to rendered scenes than pure noise
+        base = rng.integers(0, 256, size=(size // 8, size // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(base).resize((size, size), Image.BICUBIC)
+        path = os.path.join(folder, f"frame{i:05d}.jpg")
+        image.save(path, quality=75)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root-dir", default=None, help="Training tree to sample frames from")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=64, help="Synthetic frame size")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        if args.root_dir:
+            paths = tree_frames(args.root_dir, args.frames)
+        else:
+            paths = synthetic_frames(folder, args.frames, args.size)
+        print(f"Decoding {len(paths)} frames x {args.repeats}")
+
+        results = benchmark_decoders(paths, repeats=args.repeats)
+        print(f"{'decoder':<14} {'frames/s':>12} {'identical':>10}")
+        for name, result in results.items():
+            print(f"{name:<14} {result['frames_per_s']:>12.0f} {str(result['identical']):>10}")
+        print("Selected: ", select_decoder(paths[:64], repeats=args.repeats))
+
+
+if __name__ == '__main__':
+    main()
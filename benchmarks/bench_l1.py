@@ -0,0 +1,87 @@
+"""
+Cost of the autograd L1 penalty against the optimizer-level L1Penalty.
+
+The benchmark builds the ResNet3D of the training scripts (1024 channels in the last
+block) and times the L1 part of a training step only: the autograd penalty with its
+backward, the foreach gradient term, and the proximal step. It also checks that the
+gradient term reproduces the autograd gradient.
+
+Usage:
+    python -m benchmarks.bench_l1 --repeats 20 --model resnet
+"""
+import argparse
+import time
+
+import torch
+
+from l1_penalty import L1Penalty
+
+
+def timed(fn, repeats, device):
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["resnet", "lstm"], default="resnet")
+    parser.add_argument("--lambda-l1", type=float, default=1e-4)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    if args.model == "lstm":
+        from resnet_predictaverage_LSTM import ResNet3D, l1_regularization
+    else:
+        from resnet_predictaverage import ResNet3D, l1_regularization
+    device = torch.device(args.device)
+    model = ResNet3D(num_classes=6).to(device)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9)
+    num_params = sum(p.numel() for p in model.parameters())
+    print(f"{len(list(model.parameters()))} tensors, {num_params / 1e6:.1f}M parameters")
+
+    def autograd_l1():
+        model.zero_grad(set_to_none=False)
+        l1_regularization(model, args.lambda_l1).backward()
+
+    autograd_l1()
+    expected = [p.grad.clone() for p in model.parameters()]
+
+    gradient_penalty = L1Penalty(optimizer, args.lambda_l1, mode="gradient")
+
+    def gradient_l1():
+        model.zero_grad(set_to_none=False)
+        gradient_penalty.value()
+        gradient_penalty.before_clip()
+
+    gradient_l1()
+    max_diff = max((p.grad - g).abs().max().item() for p, g in zip(model.parameters(), expected))
+
+    proximal_penalty = L1Penalty(optimizer, args.lambda_l1, mode="proximal")
+    # Proximal steps shrink the weights, so time them on a copy
+    saved = [p.detach().clone() for p in model.parameters()]
+
+    results = [
+        ("autograd l1_regularization", timed(autograd_l1, args.repeats, device)),
+        ("foreach gradient term", timed(gradient_l1, args.repeats, device)),
+        ("foreach proximal step", timed(proximal_penalty.after_step, args.repeats, device)),
+    ]
+    with torch.no_grad():
+        for p, s in zip(model.parameters(), saved):
+            p.copy_(s)
+
+    print(f"{'method':<28} {'ms/step':>10}")
+    for name, seconds in results:
+        print(f"{name:<28} {seconds * 1e3:>10.2f}")
+    print(f"Max gradient difference (foreach vs autograd): {max_diff:.3g}")
+
+
+if __name__ == '__main__':
+    main()
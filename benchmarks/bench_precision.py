@@ -0,0 +1,85 @@
+"""
+Training throughput and final-loss parity of each precision mode.
+
+Every mode trains a freshly seeded ResNet3D on the same synthetic batches for a fixed
+number of steps, with the forward pass under Precision.autocast and the same clipped
+SGD step as the training scripts. Reports samples/s and the final loss relative to fp32.
+
+Usage:
+    python -m benchmarks.bench_precision --steps 20 --batch-size 4 --model lstm
+"""
+import argparse
+import time
+
+import torch
+import torch.nn as nn
+
+from precision import PRECISIONS, Precision
+
+
+def build_model(name, num_outputs):
+    if name == "lstm":
+        from resnet_predictaverage_LSTM import ResNet3D, initialize_weights
+    else:
+        from resnet_predictaverage import ResNet3D, initialize_weights
+    model = ResNet3D(num_classes=num_outputs, dropout_prob=0.0)
+    model.apply(initialize_weights)
+    return model
+
+
+def train(mode, args, device, batches):
+    torch.manual_seed(0)
+    model = build_model(args.model, args.outputs).to(device)
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-3, momentum=0.9)
+    precision = Precision(mode, device)
+    criterion = nn.MSELoss()
+
+    def step(inputs, labels):
+        optimizer.zero_grad()
+        with precision.autocast():
+            predictions = model(inputs)
+        loss = criterion(predictions.float(), labels)
+        precision.backward(loss)
+        precision.step(optimizer, model.parameters(), max_norm=1.0)
+        return loss
+
+    step(*batches[0])  # Warm-up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for inputs, labels in batches[1:]:
+        loss = step(inputs, labels)
+    final_loss = loss.item()
+    elapsed = time.perf_counter() - start
+    return (len(batches) - 1) * args.batch_size / elapsed, final_loss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=["resnet", "lstm"], default="resnet")
+    parser.add_argument("--modes", nargs="+", choices=PRECISIONS, default=None,
+                        help="Default: all modes on CUDA, fp32 and bf16 on CPU (fp16 backward is very slow there)")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--outputs", type=int, default=6)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    modes = args.modes or (list(PRECISIONS) if device.type == "cuda" else ["fp32", "bf16"])
+    generator = torch.Generator().manual_seed(0)
+    batches = [(torch.rand(args.batch_size, 1, args.frames, args.size, args.size, generator=generator).to(device),
+                torch.randn(args.batch_size, args.outputs, generator=generator).to(device))
+               for _ in range(args.steps + 1)]
+
+    results = {mode: train(mode, args, device, batches) for mode in modes}
+    reference = results.get("fp32", next(iter(results.values())))[1]
+    print(f"{'mode':<6} {'samples/s':>10} {'final loss':>12} {'vs fp32':>9}")
+    for mode, (samples_per_s, final_loss) in results.items():
+        print(f"{mode:<6} {samples_per_s:>10.1f} {final_loss:>12.5f} {(final_loss - reference) / abs(reference):>+8.2%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Simulate the per-worker frame cache hit rate under full shuffling and chunked shuffling.
+
+Batches are assigned to workers round-robin, as the DataLoader does, and each worker
+replays the frames of its windows through its own FrameCache. No images are decoded.
+
+Usage:
+    python -m benchmarks.bench_sampler_locality
+"""
+import argparse
+
+import numpy as np
+
+from frame_cache import FrameCache
+from samplers import ChunkedShuffleBatchSampler
+
+
+def simulate(batches, offsets, frames_per_stack, num_workers, cache_frames):
+    caches = [FrameCache(cache_frames) for _ in range(num_workers)]
+    for position, batch in enumerate(batches):
+        cache = caches[position % num_workers]
+        for idx in batch:
+            seq = int(np.searchsorted(offsets, idx, side='right')) - 1
+            start = idx - offsets[seq]
+            for frame in range(start, start + frames_per_stack):
+                key = (seq, int(frame))
+                if cache.get(key) is None:
+                    cache.put(key, np.empty(1, dtype=np.uint8))
+    hits = sum(c.hits for c in caches)
+    lookups = hits + sum(c.misses for c in caches)
+    return hits / lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sequences", type=int, default=200)
+    parser.add_argument("--frames-per-sequence", type=int, default=300)
+    parser.add_argument("--frames-per-stack", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--num-workers", type=int, default=12)
+    parser.add_argument("--cache-frames", type=int, default=2048, help="Cache budget per worker, in frames")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1, 16, 64, 256])
+    args = parser.parse_args()
+
+    num_stacks = args.frames_per_sequence - args.frames_per_stack
+    offsets = np.arange(args.sequences + 1, dtype=np.int64) * num_stacks
+    ranges = np.stack([offsets[:-1], offsets[1:]], axis=1)
+
+    print(f"{'chunk size':>10} {'hit rate':>9}")
+    for chunk_size in args.chunk_sizes:
+        sampler = ChunkedShuffleBatchSampler(ranges, args.batch_size, chunk_size=chunk_size,
+                                             num_workers=args.num_workers)
+        hit_rate = simulate(list(sampler), offsets, args.frames_per_stack, args.num_workers, args.cache_frames)
+        print(f"{chunk_size:>10} {hit_rate:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
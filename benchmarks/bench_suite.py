@@ -0,0 +1,383 @@
+"""
+Benchmark suite for the data pipeline, the models and the loss helpers, on synthetic data.
+
+The suite writes a synthetic subject/sequence/frames + labels.csv tree (random JPEG
+frames and label rows, laid out like TrainingData2/) to a temporary directory, or
+reuses `--tree`. Then it times:
+- dataset: StackedFramesDataset.__getitem__ on random windows for each decoder, as
+  float32 and uint8 stacks, and sequential windows through a cold frame cache. Before
+  timing, `check_input_scale` asserts that training batches (batched or per-frame
+  augmentation, with the random ops off) and evaluation batches reach the model on the
+  same scale, collate.INPUT_SCALE.
+- loader: a DataLoader epoch (ChunkedShuffleBatchSampler + stack_collate, as in the
+  training scripts) for each worker count, including worker startup.
+- model: ResNet3D and its LSTM variant, forward and forward/backward, for each
+  TxHxWxB shape.
+- loss: correlation_loss, variability_loss and l1_regularization (forward and
+  backward), and L1Penalty.before_clip.
+
+Every case reports the median, min and max seconds over `--repeats` runs, and the rate
+it implies. `--out` writes the results to JSON. `--baseline` compares the median times
+with an earlier JSON and flags cases that are slower by more than `--threshold`. The
+exit status is 1 if any case regressed, so the suite can gate a change. Only compare
+runs from the same machine and thread count; the JSON records both.
+
+Usage:
+    python -m benchmarks.bench_suite --out baseline.json
+    python -m benchmarks.bench_suite --out new.json --baseline baseline.json
+    python -m benchmarks.bench_suite --compare new.json --baseline baseline.json
+    python -m benchmarks.bench_suite --quick --groups dataset loader
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+from augment import StackAugment
+from collate import stack_collate, to_model_input
+from decoders import available_decoders, get_decoder
+from frame_cache import FrameCache
+from l1_penalty import L1Penalty
+from samplers import ChunkedShuffleBatchSampler
+
+GROUPS = ("dataset", "loader", "model", "loss")
+LABEL_COLUMNS = ["ImageName", "dx", "dy", "dz", "rx", "ry", "rz", "gdx", "gdy", "gdz", "SaccadeFlag"]
+
+
+def make_tree(root, subjects=2, sequences=2, frames=60, size=64, seed=0):
+    """
+    Write a synthetic tree of `subjects` x `sequences` folders, each with `frames`
+    grayscale-looking JPEG frames of `size` x `size` and a matching labels.csv.
+    """
+    rng = np.random.default_rng(seed)
+    for s in range(subjects):
+        for q in range(sequences):
+            sequence_path = os.path.join(root, f"subject{s}", f"{q}")
+            os.makedirs(sequence_path, exist_ok=True)
+            # Smooth blobs compress and decode like the rendered frames, unlike white noise
+            base = rng.integers(0, 255, (size // 8 + 1, size // 8 + 1), dtype=np.uint8)
+            for i in range(frames):
+                shifted = np.roll(base, i, axis=1)
+                pixels = np.asarray(Image.fromarray(shifted).resize((size, size), Image.BILINEAR))
+                rgb = np.repeat(pixels[:, :, None], 3, axis=2)
+                Image.fromarray(rgb).save(os.path.join(sequence_path, f"subject{s}_trial{q}_frame{i:04d}.jpg"), quality=90)
+            with open(os.path.join(sequence_path, "labels.csv"), "w") as f:
+                f.write(",".join(LABEL_COLUMNS) + "\n")
+                for i, row in enumerate(rng.normal(scale=0.05, size=(frames, len(LABEL_COLUMNS) - 1))):
+                    f.write(",".join([f"frame{i:04d}.jpg"] + [f"{v:.5f}" for v in row]) + "\n")
+
+
+def time_calls(fn, repeats, warmup=1):
+    """Seconds of each of `repeats` calls of `fn`, after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def record(results, group, name, times, items, unit):
+    """Add a case to `results`; `items` `unit`s are processed per call."""
+    median = float(np.median(times))
+    key = f"{group}/{name}"
+    results[key] = {
+        "group": group,
+        "median_s": median,
+        "min_s": float(min(times)),
+        "max_s": float(max(times)),
+        "repeats": len(times),
+        "rate": items / median if median > 0 else float("inf"),
+        "rate_unit": f"{unit}/s",
+    }
+    print(f"{key:<48} {median * 1e3:>10.2f} ms {items / median:>12.1f} {unit}/s")
+
+
+def load_dataset(root, args):
+    from resnet_predictaverage import StackedFramesDataset
+
+    return StackedFramesDataset(root, frames_per_stack=args.frames_per_stack, use_manifest=False, as_uint8=True)
+
+
+def dataset_view(dataset, decoder="pil", as_uint8=True):
+    # Same scanned sequences, another decoder or output dtype
+    view = copy.copy(dataset)
+    view.decoder, view._decode, view.as_uint8 = decoder, get_decoder(decoder), as_uint8
+    return view
+
+
+@torch.no_grad()
+def check_input_scale(dataset, indices):
+    """
+    Assert that the windows `indices` reach the model with the same statistics through
+    every input path, with augmentation switched off:
+    - training with StackAugment (no rotation, blur or noise) on uint8 batches,
+    - training with per-frame transforms reduced to ToTensor,
+    - evaluation through evaluate.deterministic_view.
+    """
+    from evaluate import deterministic_view
+
+    def batch(view):
+        return stack_collate([view[i] for i in indices])[0]
+
+    identity = StackAugment(degrees=0.0, sigma=(1e-3, 1e-3), noise_std=0.0)  # A 1e-3 blur is the identity
+    frame_view = copy.copy(dataset)
+    frame_view.transform, frame_view.as_uint8 = transforms.ToTensor(), False
+    paths = {
+        "batch augment": identity(to_model_input(batch(dataset_view(dataset)), "cpu")),
+        "frame augment": to_model_input(batch(frame_view), "cpu"),
+        "evaluation": to_model_input(batch(deterministic_view(dataset)), "cpu"),
+    }
+    stats = {name: torch.stack([inputs.mean(), inputs.std()]).double() for name, inputs in paths.items()}
+    reference = stats["evaluation"]
+    for name, value in stats.items():
+        assert torch.allclose(value, reference, rtol=1e-4, atol=0.0), \
+            f"{name} inputs (mean, std) {value.tolist()} differ from evaluation inputs {reference.tolist()}"
+    print(f"Input scale consistent across {', '.join(paths)}: mean {reference[0]:.3g}, std {reference[1]:.3g}")
+
+
+def bench_dataset(results, args, base):
+    check_input_scale(base, range(min(4, len(base))))
+    rng = np.random.default_rng(0)
+    for decoder in args.decoders:
+        for as_uint8 in (False, True):
+            dataset = dataset_view(base, decoder, as_uint8)
+            indices = rng.integers(0, len(dataset), size=args.fetches).tolist()
+            times = time_calls(lambda: [dataset[i] for i in indices], args.repeats)
+            record(results, "dataset", f"random {decoder} {'uint8' if as_uint8 else 'float32'}", times, len(indices), "windows")
+
+    # Overlapping windows share frames; a fresh cache per call measures one pass over them
+    dataset = dataset_view(base)
+    indices = list(range(min(args.fetches, len(dataset))))
+
+    def cached_pass():
+        dataset.frame_cache = FrameCache(256 * 2**20)
+        for i in indices:
+            dataset[i]
+
+    record(results, "dataset", "sequential pil uint8 frame-cache", time_calls(cached_pass, args.repeats), len(indices), "windows")
+
+
+def bench_loader(results, args, dataset):
+    num_windows = min(len(dataset), args.loader_batches * args.batch_size)
+    for num_workers in args.workers:
+        sampler = ChunkedShuffleBatchSampler([[0, num_windows]], batch_size=args.batch_size, num_workers=num_workers, seed=5205)
+        loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=stack_collate, num_workers=num_workers,
+                            prefetch_factor=8 if num_workers > 0 else None)
+
+        def epoch():
+            for _ in loader:
+                pass
+
+        record(results, "loader", f"epoch workers={num_workers} batch={args.batch_size}",
+               time_calls(epoch, args.repeats), num_windows, "windows")
+
+
+def build_model(name, frames, num_outputs):
+    if name == "lstm":
+        from resnet_predictaverage_LSTM import ResNet3D, initialize_weights
+    else:
+        from resnet_predictaverage import ResNet3D, initialize_weights
+    torch.manual_seed(0)
+    model = ResNet3D(num_classes=num_outputs, num_frames=frames, dropout_prob=0.0)
+    model.apply(initialize_weights)
+    return model
+
+
+def parse_shape(spec):
+    frames, height, width, batch = (int(v) for v in spec.lower().split("x"))
+    return frames, height, width, batch
+
+
+def bench_model(results, args):
+    for name in args.models:
+        for spec in args.shapes:
+            frames, height, width, batch = parse_shape(spec)
+            model = build_model(name, frames, args.outputs)
+            inputs = torch.rand(batch, 1, frames, height, width)
+            labels = torch.randn(batch, args.outputs)
+
+            model.eval()
+
+            def forward():
+                with torch.inference_mode():
+                    model(inputs)
+
+            record(results, "model", f"{name} forward {spec}", time_calls(forward, args.repeats), batch, "samples")
+
+            model.train()
+
+            def forward_backward():
+                model.zero_grad(set_to_none=True)
+                torch.nn.functional.mse_loss(model(inputs), labels).backward()
+
+            record(results, "model", f"{name} forward+backward {spec}", time_calls(forward_backward, args.repeats), batch, "samples")
+            del model
+
+
+def bench_loss(results, args):
+    from resnet_predictaverage import correlation_loss, l1_regularization, variability_loss
+
+    batch = args.loss_batch
+    predictions = torch.randn(batch, args.outputs, requires_grad=True)
+    labels = torch.randn(batch, args.outputs)
+    calls = 100
+
+    def repeated(loss_fn):
+        def run():
+            for _ in range(calls):
+                predictions.grad = None
+                loss_fn().backward()
+        return run
+
+    record(results, "loss", f"correlation_loss batch={batch}",
+           time_calls(repeated(lambda: correlation_loss(predictions, labels, weight=50.0)[1]), args.repeats), calls, "calls")
+    record(results, "loss", f"variability_loss batch={batch}",
+           time_calls(repeated(lambda: variability_loss(predictions, alpha=10.0)), args.repeats), calls, "calls")
+
+    model = build_model("resnet", args.frames_per_stack, args.outputs)
+    for param in model.parameters():
+        param.grad = torch.zeros_like(param)
+
+    def autograd_l1():
+        model.zero_grad(set_to_none=False)
+        l1_regularization(model, 1e-6).backward()
+
+    record(results, "loss", "l1_regularization resnet", time_calls(autograd_l1, args.repeats), 1, "calls")
+    penalty = L1Penalty(torch.optim.SGD(model.parameters(), lr=1e-4, momentum=0.9), 1e-6)
+    record(results, "loss", "L1Penalty.before_clip resnet", time_calls(penalty.before_clip, args.repeats), 1, "calls")
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "threads": torch.get_num_threads(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "compare")},
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Print the ratio of current to baseline median time for every case in both runs.
+
+    Returns:
+        list: Keys of the cases slower than the baseline by more than `threshold`.
+    """
+    for field in ("torch", "threads", "cpu_count", "platform"):
+        if current["environment"].get(field) != baseline["environment"].get(field):
+            print(f"Warning: {field} differs from the baseline "
+                  f"({current['environment'].get(field)} vs {baseline['environment'].get(field)})")
+    regressions = []
+    print(f"\n{'case':<48} {'baseline ms':>12} {'current ms':>11} {'ratio':>7}")
+    for key, result in current["results"].items():
+        if key not in baseline["results"]:
+            print(f"{key:<48} {'new':>12} {result['median_s'] * 1e3:>11.2f}")
+            continue
+        before = baseline["results"][key]["median_s"]
+        ratio = result["median_s"] / before
+        status = ""
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+            regressions.append(key)
+        elif ratio < 1 / (1 + threshold):
+            status = "faster"
+        print(f"{key:<48} {before * 1e3:>12.2f} {result['median_s'] * 1e3:>11.2f} {ratio:>6.2f}x {status}")
+    for key in sorted(baseline["results"].keys() - current["results"].keys()):
+        print(f"{key:<48} missing from the current run")
+    print(f"\n{len(regressions)} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--quick", action="store_true", help="Small tree, shapes and repeats, to check the suite runs")
+    parser.add_argument("--tree", default=None, help="Existing (or to be written) synthetic tree; default: a temporary directory")
+    parser.add_argument("--subjects", type=int, default=2)
+    parser.add_argument("--sequences", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=80, help="Frames per sequence")
+    parser.add_argument("--image-size", type=int, default=64)
+    parser.add_argument("--frames-per-stack", type=int, default=20)
+    parser.add_argument("--decoders", nargs="+", default=None, help="Default: every available decoder")
+    parser.add_argument("--fetches", type=int, default=50, help="Windows per dataset case")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--loader-batches", type=int, default=16)
+    parser.add_argument("--models", nargs="+", choices=["resnet", "lstm"], default=["resnet", "lstm"])
+    parser.add_argument("--shapes", nargs="+", default=["20x32x32x2", "20x64x64x1", "10x64x64x2"], help="TxHxWxB")
+    parser.add_argument("--outputs", type=int, default=6)
+    parser.add_argument("--loss-batch", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON of an earlier run to compare against")
+    parser.add_argument("--compare", default=None, help="Compare this JSON with --baseline instead of running")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        if not args.baseline:
+            parser.error("--compare needs --baseline")
+        with open(args.compare) as f:
+            current = json.load(f)
+        with open(args.baseline) as f:
+            sys.exit(1 if compare(current, json.load(f), args.threshold) else 0)
+
+    if args.quick:
+        args.subjects, args.sequences, args.frames, args.image_size = 1, 2, 30, 32
+        args.fetches, args.loader_batches, args.repeats = 10, 3, 1
+        args.workers, args.shapes = [0, 2], ["20x16x16x1"]
+    args.decoders = args.decoders or available_decoders()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temporary:
+        root = args.tree or temporary
+        if not os.path.isdir(root) or not os.listdir(root):
+            make_tree(root, args.subjects, args.sequences, args.frames, args.image_size)
+        if "dataset" in args.groups or "loader" in args.groups:
+            dataset = load_dataset(root, args)
+        print(f"{'case':<48} {'median':>13} {'rate':>12}")
+        if "dataset" in args.groups:
+            bench_dataset(results, args, dataset)
+        if "loader" in args.groups:
+            bench_loader(results, args, dataset)
+        if "model" in args.groups:
+            bench_model(results, args)
+        if "loss" in args.groups:
+            bench_loss(results, args)
+
+    current = {"environment": environment(args), "results": results}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Wrote {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            sys.exit(1 if compare(current, json.load(f), args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+Full training-state checkpoints written from a background thread.
+
+The training scripts used to `torch.save(energy_model.state_dict(), ...)` at the end of
+every epoch, on the training thread and without the optimizer, scheduler or sampler
+position, and they kept every file. Now:
+- `training_state` collects everything a run needs to continue: model, optimizer,
+  scheduler, loss scaler, epoch, batch within the epoch, global step and the torch
+  RNG states.
+- `AsyncCheckpointer.save` copies that state to host memory (for CUDA tensors, non-blocking
+  copies into pinned memory), so training can go on changing the live tensors. A
+  background thread then writes the file atomically and prunes old checkpoints, keeping
+  the last N plus the best K by validation loss. `checkpoints.json` in the directory
+  records what was written.
+- `load_checkpoint` memory-maps the file, so resuming reads only the bytes it copies.
+
+    checkpointer = AsyncCheckpointer("Resnet_models", keep_last=3, keep_best=1)
+    checkpointer.save(training_state(model, optimizer, scheduler, precision, epoch, batch, step),
+                      "model_epoch_1.pth", metric=val_loss)
+    checkpointer.close()
+"""
+import json
+import os
+import queue
+import threading
+import traceback
+
+import torch
+
+_STOP = object()
+INDEX_NAME = "checkpoints.json"
+
+
+def training_state(model, optimizer, scheduler, precision, epoch, batch, global_step, **extra):
+    """
+    Everything needed to continue training from the next batch.
+
+    Args:
+        epoch (int): Epoch to resume in.
+        batch (int): First batch of `epoch` that has not been trained on yet.
+        global_step (int): Optimizer steps taken so far.
+        extra: Further picklable entries (plain Python values or tensors).
+
+    Returns:
+        dict: Live references; `AsyncCheckpointer.save` copies them.
+    """
+    state = {
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict(),
+        "precision": precision.state_dict(),
+        "epoch": epoch,
+        "batch": batch,
+        "global_step": global_step,
+        "rng": {"torch": torch.get_rng_state()},
+    }
+    if torch.cuda.is_available():
+        state["rng"]["cuda"] = torch.cuda.get_rng_state_all()
+    state.update(extra)
+    return state
+
+
+def restore_training_state(state, model, optimizer, scheduler, precision):
+    """
+    Load a `training_state` dict into live objects.
+
+    Returns:
+        tuple: (epoch, batch, global_step) to resume from.
+    """
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    scheduler.load_state_dict(state["scheduler"])
+    precision.load_state_dict(state["precision"])
+    rng = state.get("rng", {})
+    if "torch" in rng:
+        torch.set_rng_state(rng["torch"])
+    if "cuda" in rng and torch.cuda.is_available() and len(rng["cuda"]) == torch.cuda.device_count():
+        torch.cuda.set_rng_state_all(rng["cuda"])
+    return state["epoch"], state["batch"], state["global_step"]
+
+
+def load_checkpoint(path, map_location="cpu"):
+    """torch.load a checkpoint memory-mapped; tensors are paged in when they are copied."""
+    return torch.load(path, map_location=map_location, mmap=True, weights_only=True)
+
+
+def model_weights(state):
+    """Model state dict of a `training_state` checkpoint, or the checkpoint itself if it only holds weights."""
+    if isinstance(state.get("model"), dict):
+        return state["model"]
+    return state
+
+
+def _snapshot(value, copies):
+    if torch.is_tensor(value):
+        value = value.detach()
+        if value.device.type == "cuda":
+            host = torch.empty(value.shape, dtype=value.dtype, pin_memory=True)
+            host.copy_(value, non_blocking=True)
+            copies.append(value.device)
+            return host
+        return value.clone()
+    if isinstance(value, dict):
+        return type(value)((key, _snapshot(item, copies)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(_snapshot(item, copies) for item in value)
+    return value
+
+
+def snapshot(state):
+    """
+    Copy every tensor of a nested state to host memory.
+
+    Returns:
+        tuple: (copied state, CUDA events to wait on before the copies are complete).
+    """
+    copies = []
+    state = _snapshot(state, copies)
+    events = []
+    for device in set(copies):
+        event = torch.cuda.Event()
+        event.record(torch.cuda.current_stream(device))
+        events.append(event)
+    return state, events
+
+
+def read_index(directory):
+    """Entries of `<directory>/checkpoints.json` whose files still exist, oldest first."""
+    path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        entries = json.load(f)
+    return [entry for entry in entries if os.path.exists(os.path.join(directory, entry["name"]))]
+
+
+def latest_checkpoint(directory):
+    """Path of the most recently written checkpoint in `directory`, or None."""
+    entries = read_index(directory)
+    if not entries:
+        return None
+    return os.path.join(directory, entries[-1]["name"])
+
+
+class AsyncCheckpointer:
+    """
+    Write checkpoints from a background thread and prune old ones.
+
+    Only files listed in the directory's checkpoints.json are ever deleted, so weights
+    saved by older runs are left alone.
+
+    Args:
+        directory (str): Where checkpoints are written.
+        keep_last (int): Most recent checkpoints to keep (0 keeps all).
+        keep_best (int): Checkpoints with the lowest metric to keep in addition.
+        max_pending (int): Snapshots held in memory before `save` waits for the writer.
+    """
+
+    def __init__(self, directory, keep_last=3, keep_best=1, max_pending=1):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, INDEX_NAME)
+        self.entries = read_index(directory)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="checkpointer", daemon=True)
+        self._thread.start()
+
+    def save(self, state, name, metric=None):
+        """
+        Snapshot `state` now and write it to `<directory>/<name>` in the background.
+
+        Args:
+            state (dict): E.g. from `training_state`.
+            name (str): File name inside the directory.
+            metric (float): Lower is better; checkpoints without one are only kept by recency.
+        """
+        state, events = snapshot(state)
+        info = {"name": name, "epoch": state.get("epoch"), "batch": state.get("batch"),
+                "global_step": state.get("global_step"), "metric": metric}
+        self._queue.put((state, events, info))
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            try:
+                if record is _STOP:
+                    return
+                self._write(*record)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def _write(self, state, events, info):
+        for event in events:
+            event.synchronize()
+        path = os.path.join(self.directory, info["name"])
+        torch.save(state, path + ".tmp")
+        os.replace(path + ".tmp", path)  # A crash mid-write never leaves a truncated checkpoint
+        self.entries = [entry for entry in self.entries if entry["name"] != info["name"]] + [info]
+        self._prune()
+        with open(self._index_path + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(self._index_path + ".tmp", self._index_path)
+
+    def _prune(self):
+        keep = set()
+        if self.keep_last <= 0:
+            keep.update(entry["name"] for entry in self.entries)
+        else:
+            keep.update(entry["name"] for entry in self.entries[-self.keep_last:])
+        scored = [entry for entry in self.entries if entry["metric"] is not None]
+        keep.update(entry["name"] for entry in sorted(scored, key=lambda e: e["metric"])[:self.keep_best])
+        for entry in self.entries:
+            if entry["name"] not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, entry["name"]))
+                except FileNotFoundError:
+                    pass
+        self.entries = [entry for entry in self.entries if entry["name"] in keep]
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
@@ -0,0 +1,54 @@
+"""
+Collate function that builds model-ready frame batches in the DataLoader workers.
+
+StackedFramesDataset yields stacks as uint8 [T, H, W] (or float [T, 1, H, W] after
+per-frame transforms). The default collate stacks them into [B, T, 1, H, W], which the
+training loop then squeezed and permuted on the main thread. `stack_collate` writes the
+samples straight into one contiguous [B, 1, T, H, W] tensor, in shared memory when it
+runs in a worker, so the batch crosses the worker queue and pinned memory without
+further copies. uint8 batches are a quarter of the size of float32 ones; `to_model_input`
+scales them after they reach the device.
+
+Model inputs are pixel values times `INPUT_SCALE`, i.e. pixel / 255 / 255. This is the
+scale the original per-frame pipeline produced (ToTensor's division by 255, then the
+dataset's own division by 255), and every path into the model uses it:
+- `normalize_frames` (through `to_model_input`) for uint8 training and evaluation batches,
+  before and without StackAugment.
+- StackedFramesDataset's float32 stacks, with or without per-frame transforms.
+"""
+import torch
+from torch.utils.data import get_worker_info
+
+INPUT_SCALE = 1.0 / (255.0 * 255.0)
+
+
+def stack_collate(batch):
+    """
+    Collate (stack, target) samples.
+
+    Returns:
+        tuple: (inputs [B, 1, T, H, W] with the dtype of the samples, targets [B, ...]).
+    """
+    images, targets = zip(*batch)
+    first = images[0]
+    shape = (len(images), 1, first.shape[0], first.shape[-2], first.shape[-1])
+    out = None
+    if get_worker_info() is not None:
+        # Stack directly into shared memory to avoid a copy when the batch is sent to the main process
+        storage = first._typed_storage()._new_shared(sum(image.numel() for image in images), device=first.device)
+        out = first.new(storage).resize_(shape)
+    inputs = torch.stack([image.reshape(shape[1:]) for image in images], 0, out=out)
+    return inputs, torch.stack(targets, 0)
+
+
+def normalize_frames(frames):
+    """uint8 frames as float32 model inputs, pixel * INPUT_SCALE."""
+    return frames.float().mul_(INPUT_SCALE)
+
+
+def to_model_input(inputs, device):
+    """Move a collated batch to `device`; uint8 frames are normalized there, float batches are already."""
+    inputs = inputs.to(device, non_blocking=True)
+    if not inputs.is_floating_point():
+        inputs = normalize_frames(inputs)
+    return inputs
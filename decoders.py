@@ -0,0 +1,111 @@
+"""
+Grayscale frame decoders used by StackedFramesDataset.
+
+Every decoder takes a file path and returns a uint8 [H, W] array. "pil" is the
+reference: PIL's decode followed by convert("L"), as the training scripts have always
+done. The others can be faster but may round differently (JPEG draft mode and OpenCV
+read the luma plane straight from the decoder instead of converting from RGB), so
+`select_decoder` only picks a backend that is pixel-identical to "pil" on sample frames.
+"""
+import time
+
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from torchvision.io import ImageReadMode, decode_image, read_file
+except ImportError:
+    decode_image = None
+
+REFERENCE = "pil"
+
+
+def decode_pil(path):
+    return np.asarray(Image.open(path).convert("L"))
+
+
+def decode_pil_draft(path):
+    image = Image.open(path)
+    if image.format == "JPEG":
+        # Let libjpeg decode only the luma plane at full size
+        image.draft("L", image.size)
+    return np.asarray(image.convert("L"))
+
+
+def decode_cv2(path):
+    pixels = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if pixels is None:
+        raise OSError(f"OpenCV could not read {path}")
+    return pixels
+
+
+def decode_torchvision(path):
+    return decode_image(read_file(path), mode=ImageReadMode.GRAY)[0].numpy()
+
+
+DECODERS = {
+    "pil": decode_pil,
+    "pil_draft": decode_pil_draft,
+    "cv2": decode_cv2,
+    "torchvision": decode_torchvision,
+}
+
+
+def available_decoders():
+    """Names of the decoders whose library is installed."""
+    names = ["pil", "pil_draft"]
+    if cv2 is not None:
+        names.append("cv2")
+    if decode_image is not None:
+        names.append("torchvision")
+    return names
+
+
+def get_decoder(name):
+    if name not in available_decoders():
+        raise ValueError(f"Unknown or unavailable decoder '{name}'. Available: {available_decoders()}")
+    return DECODERS[name]
+
+
+def benchmark_decoders(paths, names=None, repeats=3):
+    """
+    Time each decoder on `paths` and compare its output with the reference decoder.
+
+    Returns:
+        dict: name -> {"frames_per_s": float, "identical": bool}
+    """
+    names = names or available_decoders()
+    reference = [decode_pil(path) for path in paths]
+    results = {}
+    for name in names:
+        decode = get_decoder(name)
+        try:
+            identical = all(np.array_equal(decode(path), expected) for path, expected in zip(paths, reference))
+        except Exception as e:
+            print(f"Decoder {name} failed: {e}")
+            continue
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for path in paths:
+                decode(path)
+        elapsed = time.perf_counter() - start
+        results[name] = {"frames_per_s": repeats * len(paths) / max(elapsed, 1e-9), "identical": identical}
+    return results
+
+
+def select_decoder(paths, repeats=3):
+    """
+    Fastest available decoder that reproduces the reference output on `paths`.
+
+    Falls back to the reference decoder when `paths` is empty.
+    """
+    if len(paths) == 0:
+        return REFERENCE
+    results = benchmark_decoders(paths, repeats=repeats)
+    identical = [name for name, result in results.items() if result["identical"]]
+    return max(identical, key=lambda name: results[name]["frames_per_s"])
@@ -0,0 +1,137 @@
+"""
+Device selection and torch.distributed helpers for the training scripts.
+
+The scripts used to hardcode `cuda:0` or `cuda:1` and could only train on one device.
+These helpers let the same script run as a single process or as one rank of a
+DistributedDataParallel job started by `launch.py` (or torchrun):
+- `resolve_device` turns "auto", "cpu", "cuda" or "cuda:N" into a device. Under a
+  launcher, "auto" means the GPU of the local rank, or the CPU.
+- `init_distributed` joins the process group when the launcher environment
+  (WORLD_SIZE, RANK, LOCAL_RANK) is set. It uses NCCL on GPUs and gloo on CPUs, so
+  scaling can be tested without GPUs.
+- `all_reduce_sum` / `all_reduce_mean` reduce metrics over the ranks, and are no-ops
+  in a single process.
+- `is_main_process` gates logging, figures and checkpoints to rank 0.
+"""
+import os
+from contextlib import nullcontext
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def local_rank():
+    """Rank of this process on its node, as set by the launcher (0 without one)."""
+    return int(os.environ.get("LOCAL_RANK", 0))
+
+
+def resolve_device(spec="auto"):
+    """
+    Device for this process.
+
+    Args:
+        spec (str): "auto" (the local rank's GPU if CUDA is available, else the CPU),
+            "cpu", "cuda" (the local rank's GPU) or an explicit device such as "cuda:1".
+    """
+    if spec == "auto":
+        spec = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(spec)
+    if device.type == "cuda":
+        if device.index is None:
+            device = torch.device("cuda", local_rank())
+        torch.cuda.set_device(device)
+    return device
+
+
+def init_distributed(device, backend=None):
+    """
+    Join the process group if started by a launcher; otherwise do nothing.
+
+    Args:
+        device (torch.device): Device of this rank, from `resolve_device`.
+        backend (str): "nccl", "gloo" or None to pick by device type.
+
+    Returns:
+        bool: True if this process is one rank of a distributed job.
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1 or is_distributed():
+        return is_distributed()
+    backend = backend or ("nccl" if device.type == "cuda" else "gloo")
+    dist.init_process_group(backend=backend, device_id=device if device.type == "cuda" else None)
+    return True
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def wrap_ddp(model, device):
+    """Wrap a model in DistributedDataParallel when running distributed; returns `model` otherwise."""
+    if not is_distributed():
+        return model
+    return DistributedDataParallel(model, device_ids=[device] if device.type == "cuda" else None)
+
+
+def all_reduce_sum(tensor):
+    """Sum `tensor` over all ranks in place and return it."""
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def all_reduce_mean(tensor):
+    """Average `tensor` over all ranks in place and return it."""
+    if is_distributed():
+        all_reduce_sum(tensor)
+        tensor /= get_world_size()
+    return tensor
+
+
+def all_reduce_min(tensor):
+    """Minimum of `tensor` over all ranks, in place."""
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.MIN)
+    return tensor
+
+
+def no_sync(model, skip=True):
+    """
+    `model.no_sync()` for a (possibly compiled) DDP model when `skip`, else a null context.
+
+    Forward and backward passes inside it accumulate gradients locally without an all-reduce.
+    """
+    module = getattr(model, "_orig_mod", model)
+    if skip and isinstance(module, DistributedDataParallel):
+        return module.no_sync()
+    return nullcontext()
+
+
+@torch.no_grad()
+def broadcast_buffers(module, src=0):
+    """Copy the buffers (e.g. BatchNorm running statistics) of rank `src` to every rank."""
+    if is_distributed():
+        for buffer in module.buffers():
+            dist.broadcast(buffer, src)
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
@@ -0,0 +1,220 @@
+"""
+Evaluation of trained models on every held-out window.
+
+During training, validation read the augmented training dataset through a single-process
+loader with the training batch size and shuffling. These helpers evaluate differently:
+- `deterministic_view` shares the dataset's index but returns plain uint8 stacks, with
+  no transform. `to_model_input` normalizes them to collate.INPUT_SCALE, the scale the
+  model trains on.
+- `eval_loader` walks the windows in order, in large batches, with parallel workers.
+- `evaluate` runs the model under torch.inference_mode and returns the mean loss and
+  the throughput in samples/s. It can also fill a RegressionAccumulator and a
+  ReservoirSample.
+
+The training scripts call `evaluate` once per epoch. Saved checkpoints can be
+evaluated from the command line:
+
+    python evaluate.py Resnet_models/model_epoch_*.pth --root-dir TrainingData2/ --split-by sequence
+
+Use the training run's --split-by, and the same root or packed dir, so the held-out
+windows are the ones training never saw.
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import re
+import time
+from contextlib import nullcontext
+
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from checkpointing import load_checkpoint, model_weights
+from collate import stack_collate, to_model_input
+from distributed import all_reduce_sum
+from execution import prepare_model, to_memory_format
+from label_codec import LabelCodec
+from precision import PRECISIONS, Precision
+from splits import RangeSubset
+from streaming_metrics import RegressionAccumulator
+
+
+def deterministic_view(dataset):
+    """
+    Shallow copy of a StackedFramesDataset that returns raw uint8 stacks with no transform.
+
+    The copy shares the sequence index, targets and frame cache settings of `dataset`,
+    so nothing is rescanned.
+    """
+    view = copy.copy(dataset)
+    view.transform = None
+    view.as_uint8 = True
+    return view
+
+
+def eval_loader(dataset, ranges=None, batch_size=64, num_workers=4, pin_memory=True):
+    """
+    DataLoader over `dataset` (restricted to [start, stop) `ranges` if given) in index order.
+
+    Windows are read in order, so neighbouring windows share decoded frames in each
+    worker's frame cache.
+    """
+    if ranges is not None:
+        dataset = RangeSubset(dataset, ranges)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        collate_fn=stack_collate,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=num_workers > 0,
+        prefetch_factor=4 if num_workers > 0 else None,
+    )
+
+
+@torch.inference_mode()
+def evaluate(model, loader, device, criterion=None, label_codec=None, precision=None, channels_last=False,
+             stats=None, sample=None):
+    """
+    Evaluate `model` on every batch of `loader`.
+
+    Args:
+        model: Model (or compiled / channels_last wrapper) to run; it is put in eval mode.
+        loader: Loader of (inputs, encoded targets) batches, e.g. from `eval_loader`.
+        device: Device to run on.
+        criterion: Loss on encoded predictions and targets with mean reduction (default MSE).
+        label_codec (LabelCodec): If given, `stats` and `sample` get decoded values.
+        precision (Precision): Autocast of the forward pass (default float32).
+        channels_last (bool): Feed inputs in channels_last_3d format.
+        stats (RegressionAccumulator): Optional, updated with every batch.
+        sample (ReservoirSample): Optional, updated with every batch.
+
+    Returns:
+        dict: "loss" (mean per sample), "samples", "seconds" and "samples_per_s". The
+            timing covers the whole pass, data loading included. When torch.distributed
+            is initialized, loss, samples and `stats` cover all ranks.
+    """
+    criterion = criterion or nn.MSELoss(reduction='mean')
+    model.eval()
+    total_loss = torch.zeros((), dtype=torch.float64, device=device)
+    num_samples = 0
+    start = time.perf_counter()
+    for inputs, labels in loader:
+        inputs, labels = to_model_input(inputs, device), labels.to(device, non_blocking=True)
+        with precision.autocast() if precision is not None else nullcontext():
+            predictions = model(to_memory_format(inputs, channels_last))
+        predictions = predictions.float()
+        total_loss += criterion(predictions, labels).double() * len(labels)
+        num_samples += len(labels)
+        if stats is not None or sample is not None:
+            if label_codec is not None:
+                predictions, labels = label_codec.decode(predictions), label_codec.decode(labels)
+            if stats is not None:
+                stats.update(predictions, labels)
+            if sample is not None:
+                sample.update(predictions, labels)
+    # Under torch.distributed, every rank evaluates its own windows and the results are combined
+    totals = all_reduce_sum(torch.stack([total_loss, torch.tensor(float(num_samples), dtype=torch.float64, device=device)]))
+    if stats is not None:
+        stats.all_reduce()
+    num_samples = int(totals[1].item())  # Waits for the last batch
+    loss = totals[0].item() / max(num_samples, 1)
+    seconds = time.perf_counter() - start
+    return {
+        "loss": loss,
+        "samples": num_samples,
+        "seconds": seconds,
+        "samples_per_s": num_samples / seconds if seconds > 0 else 0.0,
+    }
+
+
+def _epoch_key(path):
+    # Sort model_epoch_10.pth after model_epoch_9.pth
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def expand_checkpoints(patterns):
+    """Expand glob patterns (also quoted ones) into checkpoint paths in epoch order."""
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        paths.extend(matches if matches else [pattern])
+    return sorted(dict.fromkeys(paths), key=_epoch_key)
+
+
+def load_model(model_name, checkpoint, num_outputs, device):
+    """Build the ResNet3D of the "resnet" or "lstm" training script and load the weights of a checkpoint."""
+    if model_name == "lstm":
+        from resnet_predictaverage_LSTM import ResNet3D
+    else:
+        from resnet_predictaverage import ResNet3D
+    model = ResNet3D(num_classes=num_outputs).to(device)
+    model.load_state_dict(model_weights(load_checkpoint(checkpoint)))
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("checkpoints", nargs="+", help="Saved checkpoints, e.g. 'Resnet_models/model_epoch_*.pth'")
+    parser.add_argument("--model", choices=["resnet", "lstm"], default="resnet", help="Training script the checkpoints come from")
+    parser.add_argument("--root-dir", default="TrainingData2/")
+    parser.add_argument("--packed-dir", default=None)
+    parser.add_argument("--frame-cache-mb", type=float, default=256, help="Per-worker LRU cache of decoded frames, in MB")
+    parser.add_argument("--decoder", choices=["auto", "pil", "pil_draft", "cv2", "torchvision"], default="pil")
+    parser.add_argument("--windows", choices=["val", "train", "all"], default="val", help="Held-out windows, training windows, or the whole tree")
+    parser.add_argument("--split-by", choices=["sequence", "subject"], default="sequence", help="Split of the training run")
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=5205)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.model == "lstm":
+        from resnet_predictaverage_LSTM import StackedFramesDataset
+    else:
+        from resnet_predictaverage import StackedFramesDataset
+    device = torch.device(args.device)
+    # Same targets as the training scripts
+    label_codec = LabelCodec(columns=[1, 2, 3, 4, 8, 9], scale=100.0)
+    dataset = StackedFramesDataset(root_dir=args.root_dir, frames_per_stack=20, packed_dir=args.packed_dir,
+                                   cache_bytes=int(args.frame_cache_mb * 2**20), label_codec=label_codec,
+                                   decoder=args.decoder, as_uint8=True)
+    ranges = None
+    if args.windows != "all":
+        train_ranges, val_ranges = dataset.split(by=args.split_by, val_fraction=args.val_fraction, seed=args.seed)
+        ranges = val_ranges if args.windows == "val" else train_ranges
+    loader = eval_loader(dataset, ranges, batch_size=args.batch_size, num_workers=args.workers,
+                         pin_memory=device.type == "cuda")
+    print(f"Evaluating {len(loader.dataset)} {args.windows} windows")
+    precision = Precision(args.precision, device)
+    stats = RegressionAccumulator(label_codec.num_outputs, device)
+
+    results = []
+    print(f"{'checkpoint':<40} {'loss':>10} {'mean r':>8} {'mean R²':>8} {'samples/s':>10}")
+    for checkpoint in expand_checkpoints(args.checkpoints):
+        model = load_model(args.model, checkpoint, label_codec.num_outputs, device)
+        model = prepare_model(model, channels_last=args.channels_last)
+        stats.reset()
+        result = evaluate(model, loader, device, label_codec=label_codec, precision=precision,
+                          channels_last=args.channels_last, stats=stats)
+        result.update({name: values.tolist() for name, values in stats.compute().items()})
+        result["checkpoint"] = checkpoint
+        results.append(result)
+        print(f"{checkpoint:<40} {result['loss']:>10.4f} {sum(result['correlation']) / len(result['correlation']):>8.3f} "
+              f"{sum(result['r2']) / len(result['r2']):>8.3f} {result['samples_per_s']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
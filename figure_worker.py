@@ -0,0 +1,153 @@
+"""
+Predicted-vs-actual figures drawn in a separate process.
+
+At the end of every training and validation epoch the scripts plotted a 2x3 grid of
+predicted vs actual translation and rotation. Each panel had a linear fit and an R²
+from sklearn, and the figure was drawn with matplotlib on the main process before the
+next epoch could start. Here the fit and R² of all six columns are computed in one
+vectorized pass on the device (`regression_stats`). Only the finished numbers are
+copied to the host, and `FigureWorker` hands them to a spawned process, which draws
+the figure and writes it to TensorBoard with its own SummaryWriter.
+
+    figures = FigureWorker(writer.get_logdir())
+    figures.submit("Training", predictions, labels, global_step)
+    figures.close()
+"""
+import multiprocessing as mp
+import queue
+
+import numpy as np
+import torch
+
+TRANSLATION = ["X", "Y", "Z"]
+ROTATION = ["Roll", "Pitch", "Yaw"]
+
+
+@torch.no_grad()
+def regression_stats(predictions, labels):
+    """
+    Per-column least-squares fit of predictions on labels, and R² of the predictions.
+
+    Non-finite predictions are replaced by 0, as the figures always did.
+
+    Args:
+        predictions (torch.Tensor): [N, C] predictions.
+        labels (torch.Tensor): [N, C] ground truth.
+
+    Returns:
+        tuple: (predictions with non-finite values zeroed, slope [C], intercept [C], r2 [C]),
+            all on the input device. r2 is sklearn's r2_score(labels, predictions) per column.
+    """
+    predictions = torch.nan_to_num(predictions.double(), nan=0.0, posinf=0.0, neginf=0.0)
+    labels = labels.double()
+    label_mean = labels.mean(dim=0)
+    prediction_mean = predictions.mean(dim=0)
+    label_centered = labels - label_mean
+    label_var = (label_centered ** 2).sum(dim=0)
+    covariance = (label_centered * (predictions - prediction_mean)).sum(dim=0)
+    slope = torch.where(label_var > 0, covariance / label_var.clamp_min(1e-300), torch.zeros_like(label_var))
+    intercept = prediction_mean - slope * label_mean
+    residual = ((labels - predictions) ** 2).sum(dim=0)
+    r2 = torch.where(label_var > 0, 1.0 - residual / label_var.clamp_min(1e-300),
+                     torch.where(residual == 0, torch.ones_like(residual), torch.zeros_like(residual)))
+    return predictions, slope, intercept, r2
+
+
+def plot_predicted_vs_actual(predictions, labels, slope, intercept, r2):
+    """
+    Draw the 2x3 predicted-vs-actual grid (translation on top, rotation below).
+
+    All arguments are NumPy arrays: predictions and labels [N, 6], statistics [6].
+    """
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(2, 3, figsize=(18, 10))
+    panels = [(0, i, f"Translation {name}") for i, name in enumerate(TRANSLATION)]
+    panels += [(1, i, f"Rotation {name}") for i, name in enumerate(ROTATION)]
+    for column, (row, col, title) in enumerate(panels):
+        ax = axes[row, col]
+        y_true, y_pred = labels[:, column], predictions[:, column]
+        line_x = np.linspace(y_true.min(), y_true.max(), 100)
+        line_y = slope[column] * line_x + intercept[column]
+
+        # Plot scatter and line
+        ax.scatter(y_true, y_pred, alpha=0.5, label="Data")
+        ax.plot(line_x, line_y, color='red', label=f"Line Fit (R²={r2[column]:.2f})")
+        ax.set_title(f"{title}: Predicted vs Actual")
+        ax.set_xlabel("Actual")
+        ax.set_ylabel("Predicted")
+        ax.legend()
+    plt.tight_layout()
+    return fig
+
+
+def figure_record(predictions, labels, stats=None):
+    """
+    Compute the statistics on the device and copy everything the figure needs to NumPy.
+
+    `stats` optionally gives (slope, intercept, r2) computed over more data than the
+    plotted points, e.g. by a RegressionAccumulator.
+    """
+    predictions, slope, intercept, r2 = regression_stats(predictions.reshape(len(predictions), -1),
+                                                         labels.reshape(len(labels), -1))
+    if stats is not None:
+        slope, intercept, r2 = (torch.as_tensor(t) for t in stats)
+    return tuple(t.cpu().numpy() for t in (predictions, labels.reshape(len(labels), -1).double(), slope, intercept, r2))
+
+
+def _figure_process(log_dir, jobs):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from torch.utils.tensorboard import SummaryWriter
+
+    writer = SummaryWriter(log_dir)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        tag, step, record = job
+        fig = plot_predicted_vs_actual(*record)
+        writer.add_figure(tag, fig, step)
+        plt.close(fig)
+        writer.flush()
+    writer.close()
+
+
+class FigureWorker:
+    """
+    Spawned process that draws predicted-vs-actual figures into a TensorBoard log dir.
+
+    Args:
+        log_dir (str): TensorBoard log directory (the figures land in their own event file).
+        max_pending (int): Figures queued before new ones are dropped, so training never waits.
+    """
+
+    def __init__(self, log_dir, max_pending=4):
+        context = mp.get_context("spawn")
+        self._jobs = context.Queue(maxsize=max_pending)
+        self._process = context.Process(target=_figure_process, args=(log_dir, self._jobs), daemon=True)
+        self._process.start()
+
+    def submit(self, label, predictions, labels, global_step, stats=None):
+        """
+        Queue a figure of `predictions` vs `labels` ([N, 6] tensors, any device) under the
+        tag "<label>Predicted vs Actual (with Fit)". `stats` is passed to `figure_record`.
+
+        Returns:
+            bool: False if the figure was dropped because the worker is behind.
+        """
+        if predictions is None or len(predictions) == 0:
+            return False
+        try:
+            self._jobs.put_nowait((label + "Predicted vs Actual (with Fit)", global_step, figure_record(predictions, labels, stats)))
+        except queue.Full:
+            print(f"Figure worker is busy; skipping {label} figure at step {global_step}.")
+            return False
+        return True
+
+    def close(self):
+        """Draw the queued figures and stop the worker."""
+        if self._process.is_alive():
+            self._jobs.put(None)
+            self._process.join()
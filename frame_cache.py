@@ -0,0 +1,136 @@
+"""
+Byte-bounded LRU cache of decoded grayscale frames.
+
+Consecutive windows of StackedFramesDataset share all but one frame, so a worker
+that reads neighbouring windows can reuse most decoded frames instead of decoding
+them again with PIL. Each DataLoader worker holds its own copy of the dataset and
+therefore its own cache.
+
+Those copies, and their counters, are invisible to the training process.
+`WorkerCacheStats` gives each worker's cache a row of a shared-memory tensor to
+mirror its counters into, so the training loop can log per-worker hit rates:
+
+    cache_stats = WorkerCacheStats(num_workers)
+    loader = DataLoader(dataset, num_workers=num_workers, worker_init_fn=cache_stats.worker_init_fn)
+    ...
+    for worker, stats in enumerate(cache_stats.epoch_stats()):
+        ...
+"""
+from collections import OrderedDict
+
+import torch
+from torch.utils.data import get_worker_info
+
+
+class FrameCache:
+    """
+    Least-recently-used cache of decoded frames with a byte-size budget.
+
+    Args:
+        max_bytes (int): Total size of the cached arrays before the least recently
+            used frames are evicted.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared = None  # Optional row of WorkerCacheStats.counts mirroring the counters
+        self._frames = OrderedDict()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def get(self, key):
+        """Return the cached frame for `key`, or None, updating the hit/miss counters."""
+        frame = self._frames.get(key)
+        if frame is None:
+            self.misses += 1
+            self._publish()
+            return None
+        self._frames.move_to_end(key)
+        self.hits += 1
+        self._publish()
+        return frame
+
+    def put(self, key, frame):
+        """Cache a decoded frame. The array is made read-only since it is shared."""
+        if frame.nbytes > self.max_bytes:
+            return
+        previous = self._frames.pop(key, None)
+        if previous is not None:
+            self.current_bytes -= previous.nbytes
+        frame.setflags(write=False)
+        self._frames[key] = frame
+        self.current_bytes += frame.nbytes
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+            self.evictions += 1
+        self._publish()
+
+    def _publish(self):
+        if self.shared is not None:
+            self.shared[:] = (self.hits, self.misses, self.evictions)
+
+    def clear(self):
+        self._frames.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "frames": len(self._frames),
+            "bytes": self.current_bytes,
+        }
+
+
+class WorkerCacheStats:
+    """
+    Hit, miss and eviction counts of the frame cache in every DataLoader worker.
+
+    The counts live in a shared-memory tensor, one row per worker. It is created before the
+    DataLoader starts, and its `worker_init_fn` attaches each worker's cache to its own row.
+
+    Args:
+        num_workers (int): DataLoader workers (0 attaches the cache in this process instead).
+        dataset: With `num_workers=0`, the dataset whose `frame_cache` is counted.
+    """
+
+    FIELDS = ("hits", "misses", "evictions")
+
+    def __init__(self, num_workers, dataset=None):
+        self.counts = torch.zeros(max(num_workers, 1), len(self.FIELDS), dtype=torch.int64).share_memory_()
+        self._previous = self.counts.clone()
+        if num_workers == 0 and dataset is not None:
+            self.attach(dataset.frame_cache, 0)
+
+    def attach(self, cache, worker_id):
+        if cache is not None:
+            cache.shared = self.counts[worker_id].numpy()
+            cache._publish()
+
+    def worker_init_fn(self, worker_id):
+        """DataLoader worker_init_fn: attach this worker's copy of the dataset's frame cache."""
+        self.attach(get_worker_info().dataset.frame_cache, worker_id)
+
+    def epoch_stats(self):
+        """Per-worker counts and hit rate since the previous call."""
+        counts = self.counts.clone()
+        delta, self._previous = counts - self._previous, counts
+        stats = []
+        for row in delta.tolist():
+            worker = dict(zip(self.FIELDS, row))
+            lookups = worker["hits"] + worker["misses"]
+            worker["hit_rate"] = worker["hits"] / lookups if lookups else 0.0
+            stats.append(worker)
+        return stats
@@ -0,0 +1,214 @@
+"""
+Packed, memory-mapped frame store for StackedFramesDataset.
+
+Packing decodes every frame of a subject/sequence folder once and writes it to a
+single contiguous uint8 array, so that a training window becomes a zero-copy slice
+of a np.memmap instead of 20 file opens and decodes.
+
+Layout of a packed store:
+    <packed_dir>/<subject>/<sequence>/frames.npy   uint8 [num_frames, H, W] grayscale
+    <packed_dir>/<subject>/<sequence>/labels.npy   float64 [num_frames, num_columns]
+    <packed_dir>/<subject>/<sequence>/source.json  signature of the packed source files
+
+Packing is incremental: a sequence is only repacked when the names, sizes or
+modification times of its frames or labels.csv changed.
+
+Usage:
+    python frame_store.py TrainingData2/ TrainingData2_packed/
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+FRAME_EXTENSIONS = ('.png', '.jpg')
+SIGNATURE_FILE = "source.json"
+
+
+def read_labels(label_path):
+    """Parse a labels.csv the same way StackedFramesDataset does."""
+    labels = pd.read_csv(label_path, sep=",")
+    labels = labels.apply(pd.to_numeric, errors='coerce')
+    labels = labels.fillna(0)
+    return labels.to_numpy()
+
+
+def list_frames(sequence_path):
+    """Sorted frame file names of a sequence folder."""
+    return sorted(f for f in os.listdir(sequence_path) if f.endswith(FRAME_EXTENSIONS))
+
+
+def source_signature(sequence_path, frame_names):
+    """Hash of the names, sizes and modification times of a sequence's source files."""
+    digest = hashlib.sha1()
+    for name in frame_names + ["labels.csv"]:
+        st = os.stat(os.path.join(sequence_path, name))
+        digest.update(f"{name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def _read_signature(out_path):
+    try:
+        with open(os.path.join(out_path, SIGNATURE_FILE)) as f:
+            return json.load(f).get("signature")
+    except (OSError, ValueError):
+        return None
+
+
+def pack_sequence(sequence_path, out_path, frame_names, labels, signature):
+    """
+    Decode the frames of one sequence into `out_path/frames.npy` and store its labels.
+
+    Frames are streamed into an open memmap one at a time. The signature file is
+    written last, so an interrupted pack is simply redone on the next run.
+    """
+    os.makedirs(out_path, exist_ok=True)
+    signature_path = os.path.join(out_path, SIGNATURE_FILE)
+    if os.path.exists(signature_path):
+        os.remove(signature_path)
+
+    first = np.asarray(Image.open(os.path.join(sequence_path, frame_names[0])).convert("L"))
+    frames_tmp = os.path.join(out_path, "frames.tmp.npy")
+    frames = np.lib.format.open_memmap(frames_tmp, mode="w+", dtype=np.uint8,
+                                       shape=(len(frame_names),) + first.shape)
+    frames[0] = first
+    for i, name in enumerate(frame_names[1:], start=1):
+        image = np.asarray(Image.open(os.path.join(sequence_path, name)).convert("L"))
+        if image.shape != first.shape:
+            raise ValueError(f"Frame {name} in {sequence_path} has shape {image.shape}, expected {first.shape}.")
+        frames[i] = image
+    frames.flush()
+    del frames
+    os.replace(frames_tmp, os.path.join(out_path, "frames.npy"))
+
+    labels_tmp = os.path.join(out_path, "labels.tmp.npy")
+    np.save(labels_tmp, labels)
+    os.replace(labels_tmp, os.path.join(out_path, "labels.npy"))
+
+    with open(signature_path, "w") as f:
+        json.dump({"signature": signature, "source": os.path.abspath(sequence_path),
+                   "num_frames": len(frame_names), "frame_shape": list(first.shape)}, f)
+
+
+def pack_dataset(root_dir, packed_dir, force=False, prune=True):
+    """
+    Pack every subject/sequence folder of `root_dir` into `packed_dir`.
+
+    Args:
+        root_dir (str): Source tree laid out as subject/sequence/frames + labels.csv.
+        packed_dir (str): Destination of the packed store.
+        force (bool): Repack every sequence even if its sources are unchanged.
+        prune (bool): Remove packed sequences whose source folder no longer exists.
+
+    Returns:
+        tuple: (number of sequences packed, number skipped because up to date).
+    """
+    packed, skipped = 0, 0
+    live = set()
+    for subject in sorted(os.listdir(root_dir)):
+        subject_path = os.path.join(root_dir, subject)
+        if not os.path.isdir(subject_path):
+            continue
+        print("Packing data for: ", subject_path)
+        for sequence in sorted(os.listdir(subject_path)):
+            sequence_path = os.path.join(subject_path, sequence)
+            label_path = os.path.join(sequence_path, "labels.csv")
+            if not os.path.isdir(sequence_path) or not os.path.exists(label_path):
+                continue
+            frame_names = list_frames(sequence_path)
+            if not frame_names:
+                continue
+            out_path = os.path.join(packed_dir, subject, sequence)
+            live.add((subject, sequence))
+            signature = source_signature(sequence_path, frame_names)
+            if not force and _read_signature(out_path) == signature:
+                skipped += 1
+                continue
+            labels = read_labels(label_path)
+            if len(frame_names) != len(labels):
+                print(f"Mismatch in frames ({len(frame_names)}) and labels ({len(labels)}) in {sequence_path}.")
+                live.discard((subject, sequence))
+                continue
+            pack_sequence(sequence_path, out_path, frame_names, labels, signature)
+            packed += 1
+
+    if prune and os.path.isdir(packed_dir):
+        for subject, sequence in _packed_sequences(packed_dir):
+            if (subject, sequence) not in live:
+                shutil.rmtree(os.path.join(packed_dir, subject, sequence))
+    return packed, skipped
+
+
+def _packed_sequences(packed_dir):
+    for subject in sorted(os.listdir(packed_dir)):
+        subject_path = os.path.join(packed_dir, subject)
+        if not os.path.isdir(subject_path):
+            continue
+        for sequence in sorted(os.listdir(subject_path)):
+            if os.path.exists(os.path.join(subject_path, sequence, SIGNATURE_FILE)):
+                yield subject, sequence
+
+
+class PackedFrames:
+    """
+    Read-only view of one packed sequence.
+
+    The memmap is opened lazily in whichever process first indexes it, and is not
+    pickled, so DataLoader workers each map the file themselves instead of receiving
+    a copy of the frames.
+    """
+
+    def __init__(self, path, num_frames):
+        self.path = path
+        self.num_frames = num_frames
+        self._frames = None
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            self._frames = np.load(self.path, mmap_mode="r")
+        return self._frames
+
+    def __len__(self):
+        return self.num_frames
+
+    def __getitem__(self, item):
+        return self.frames[item]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_frames"] = None
+        return state
+
+
+def load_packed_sequences(packed_dir):
+    """
+    List the sequences of a packed store.
+
+    Returns:
+        list: (PackedFrames, labels) tuples in the format of StackedFramesDataset.data.
+    """
+    data = []
+    for subject, sequence in _packed_sequences(packed_dir):
+        sequence_path = os.path.join(packed_dir, subject, sequence)
+        labels = np.load(os.path.join(sequence_path, "labels.npy"))
+        data.append((PackedFrames(os.path.join(sequence_path, "frames.npy"), len(labels)), labels))
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root_dir", help="Source tree (subject/sequence/frames + labels.csv)")
+    parser.add_argument("packed_dir", help="Where to write the packed store")
+    parser.add_argument("--force", action="store_true", help="Repack every sequence")
+    parser.add_argument("--no-prune", dest="prune", action="store_false",
+                        help="Keep packed sequences whose source folder was removed")
+    args = parser.parse_args()
+
+    packed, skipped = pack_dataset(args.root_dir, args.packed_dir, force=args.force, prune=args.prune)
+    print(f"Packed {packed} sequences, {skipped} already up to date.")
@@ -0,0 +1,73 @@
+"""
+L1 regularization applied at the optimizer level.
+
+`l1_regularization` in the training scripts sums torch.abs(param) over every parameter
+in a Python loop each batch. Autograd then records and back-propagates a graph
+for a penalty whose gradient is just lambda * sign(param). `L1Penalty` applies the same
+regularization with a few foreach kernels and no autograd graph, in one of two modes:
+
+- "gradient": add lambda * sign(param) to the gradients after backward (and after fp16
+  unscaling) but before clipping. This is the gradient the autograd penalty produced.
+- "proximal": after the optimizer step, soft-threshold each parameter by lr * lambda.
+  This is the proximal operator of the L1 norm and drives small weights to exactly zero.
+  Call it only when the optimizer actually stepped (see `Precision.stepped`).
+
+`value()` returns the penalty as a detached tensor, so the logged loss still includes it.
+"""
+import torch
+
+L1_MODES = ("gradient", "proximal")
+
+
+class L1Penalty:
+    """
+    L1 penalty on the trainable parameters of an optimizer.
+
+    Args:
+        optimizer: Optimizer whose parameter groups are regularized (and whose learning
+            rates set the proximal threshold).
+        lambda_l1 (float): Penalty weight, in the units of the loss that is back-propagated.
+        mode (str): "gradient" or "proximal".
+    """
+
+    def __init__(self, optimizer, lambda_l1, mode="gradient"):
+        if mode not in L1_MODES:
+            raise ValueError(f"Unknown L1 mode '{mode}', expected one of {L1_MODES}.")
+        self.optimizer = optimizer
+        self.lambda_l1 = lambda_l1
+        self.mode = mode
+
+    def _groups(self):
+        for group in self.optimizer.param_groups:
+            params = [p for p in group["params"] if p.requires_grad]
+            if params:
+                yield group, params
+
+    @torch.no_grad()
+    def value(self):
+        """lambda * sum(|param|) as a detached scalar tensor."""
+        # abs().sum() matches l1_regularization; _foreach_norm(params, 1) drifts by ~1% on large float32 tensors
+        sums = [p.abs().sum() for _, params in self._groups() for p in params]
+        return self.lambda_l1 * torch.stack(sums).sum()
+
+    @torch.no_grad()
+    def before_clip(self):
+        """In "gradient" mode, add lambda * sign(param) to the (unscaled) gradients."""
+        if self.mode != "gradient" or self.lambda_l1 == 0:
+            return
+        for _, params in self._groups():
+            params = [p for p in params if p.grad is not None]
+            if params:
+                torch._foreach_add_([p.grad for p in params], torch._foreach_sign(params), alpha=self.lambda_l1)
+
+    @torch.no_grad()
+    def after_step(self):
+        """In "proximal" mode, soft-threshold parameters by lr * lambda."""
+        if self.mode != "proximal" or self.lambda_l1 == 0:
+            return
+        for group, params in self._groups():
+            # sign(w) * max(|w| - t, 0) == w - clamp(w, -t, t)
+            threshold = group["lr"] * self.lambda_l1
+            shrink = torch._foreach_clamp_max(params, threshold)
+            torch._foreach_clamp_min_(shrink, -threshold)
+            torch._foreach_sub_(params, shrink)
@@ -0,0 +1,83 @@
+"""
+Window-median targets and the label transform used by the training scripts.
+
+Each training sample is labelled with the per-column median of the 20 frame labels
+of its window. The training loop then keeps the motion columns [1, 2, 3, 4, 8, 9],
+multiplies them by 100 and compresses them with a signed log1p; plots undo this.
+`window_medians` computes all medians of a sequence at once, and `LabelCodec`
+bundles the forward and inverse transform so the dataset can apply it once at load
+time.
+"""
+import numpy as np
+import torch
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def window_medians(labels, frames_per_stack, num_windows=None):
+    """
+    Median of every window of `frames_per_stack` consecutive label rows.
+
+    Matches torch.median on float32 values, which returns the lower of the two middle
+    values for an even window length.
+
+    Args:
+        labels (np.ndarray): Frame labels [num_frames, num_columns].
+        frames_per_stack (int): Window length.
+        num_windows (int): Number of windows starting at frames 0, 1, ... to compute.
+            Defaults to num_frames - frames_per_stack, as StackedFramesDataset uses.
+
+    Returns:
+        np.ndarray: float32 medians [num_windows, num_columns].
+    """
+    labels = np.asarray(labels, dtype=np.float32)
+    if num_windows is None:
+        num_windows = len(labels) - frames_per_stack
+    num_windows = max(min(num_windows, len(labels) - frames_per_stack + 1), 0)
+    if num_windows == 0:
+        return np.zeros((0, labels.shape[1]), dtype=np.float32)
+    windows = sliding_window_view(labels[:num_windows + frames_per_stack - 1], frames_per_stack, axis=0)
+    kth = (frames_per_stack - 1) // 2
+    return np.ascontiguousarray(np.partition(windows, kth, axis=-1)[..., kth])
+
+
+class LabelCodec:
+    """
+    Column selection, scaling and signed-log compression of the motion labels.
+
+    Works on NumPy arrays and torch tensors.
+
+    Args:
+        columns (list): Label columns used as targets.
+        scale (float): Factor applied before the signed log1p.
+    """
+
+    def __init__(self, columns=(1, 2, 3, 4, 8, 9), scale=100.0):
+        self.columns = list(columns)
+        self.scale = scale
+
+    @property
+    def num_outputs(self):
+        return len(self.columns)
+
+    def compress(self, values):
+        """Scale already selected columns and apply the signed log1p."""
+        values = values * self.scale
+        if torch.is_tensor(values):
+            return torch.sign(values) * torch.log1p(torch.abs(values))
+        return np.sign(values) * np.log1p(np.abs(values))
+
+    def encode(self, labels):
+        """Raw labels [..., num_columns] -> model targets [..., len(columns)]."""
+        return self.compress(labels[..., self.columns])
+
+    def decode(self, encoded):
+        """Model targets or predictions -> selected label columns in their original units."""
+        if torch.is_tensor(encoded):
+            return torch.sign(encoded) * torch.expm1(torch.abs(encoded)) / self.scale
+        return np.sign(encoded) * np.expm1(np.abs(encoded)) / self.scale
+
+    def perturb(self, encoded, std):
+        """Add Gaussian noise with `std` in the original label units to encoded targets."""
+        raw = self.decode(encoded)
+        noise = torch.randn_like(raw) if torch.is_tensor(raw) else np.random.standard_normal(raw.shape)
+        return self.compress(raw + noise * std)
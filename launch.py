@@ -0,0 +1,44 @@
+"""
+Start a training script as a DistributedDataParallel job on one machine.
+
+Each rank is a separate process with WORLD_SIZE, RANK and LOCAL_RANK set, started
+through torch.distributed.run (torchrun). Ranks use one GPU each, or the gloo
+backend on the CPU. On the CPU, the cores are divided between the ranks so they do not
+oversubscribe the machine.
+
+Usage:
+    python launch.py --nproc 2 resnet_predictaverage.py --root-dir TrainingData2/
+    python launch.py --nproc 4 --cpu resnet_predictaverage_LSTM.py --root-dir TrainingData2/
+"""
+import argparse
+import os
+
+import torch
+from torch.distributed import run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nproc", type=int, default=None, help="Ranks to start (default: one per GPU, or 2 on the CPU)")
+    parser.add_argument("--cpu", action="store_true", help="Train on the CPU with gloo even if GPUs are present")
+    parser.add_argument("script", help="Training script")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER, help="Arguments of the training script")
+    args = parser.parse_args()
+
+    use_cuda = torch.cuda.is_available() and not args.cpu
+    nproc = args.nproc or (torch.cuda.device_count() if use_cuda else 2)
+    script_args = list(args.script_args)
+    if not use_cuda:
+        script_args += ["--device", "cpu"]
+        os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // nproc)))
+
+    run.main([
+        "--standalone",
+        f"--nproc-per-node={nproc}",
+        args.script,
+        *script_args,
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Persisted manifest of the subject/sequence tree read by StackedFramesDataset.
+
+Scanning the tree lists every subject and sequence folder, sorts the frame names
+and parses every labels.csv with pandas, which takes minutes for many subjects.
+The manifest caches the frame names and parsed labels of every sequence, keyed on
+the modification times of the subject and sequence folders and on the size and
+modification time of labels.csv. Later runs only stat the folders; a new or
+changed folder is the only one that is listed and parsed again, and label files
+are parsed in parallel.
+"""
+import os
+import pickle
+import stat
+from concurrent.futures import ProcessPoolExecutor
+
+from frame_store import list_frames, read_labels
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = ".stacked_frames_manifest.pkl"
+# Below this many label files a process pool costs more than it saves
+PARALLEL_THRESHOLD = 16
+
+
+def default_manifest_path(root_dir):
+    return os.path.join(root_dir, MANIFEST_NAME)
+
+
+def _load_manifest(manifest_path, root_dir):
+    try:
+        with open(manifest_path, "rb") as f:
+            manifest = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("root") != os.path.abspath(root_dir):
+        return {}
+    return manifest["subjects"]
+
+
+def _save_manifest(manifest_path, root_dir, subjects):
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"  # Distributed ranks may write at the same time
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": MANIFEST_VERSION, "root": os.path.abspath(root_dir), "subjects": subjects},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        print(f"Could not write dataset manifest {manifest_path}: {e}")
+
+
+def _sequence_entry(sequence_path, previous):
+    """
+    Manifest entry of one sequence folder, reusing `previous` when nothing changed.
+
+    Returns None if the path is not a folder. `labels` is None while labels.csv
+    still has to be parsed.
+    """
+    try:
+        dir_stat = os.stat(sequence_path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(dir_stat.st_mode):
+        return None
+    try:
+        label_stat = os.stat(os.path.join(sequence_path, "labels.csv"))
+        label_key = (label_stat.st_size, label_stat.st_mtime_ns)
+    except FileNotFoundError:
+        label_key = None
+
+    if previous is not None and previous["label_key"] == label_key:
+        if previous["mtime_ns"] == dir_stat.st_mtime_ns:
+            return previous
+        labels = previous["labels"]
+    else:
+        labels = None
+    return {"mtime_ns": dir_stat.st_mtime_ns, "label_key": label_key,
+            "frames": list_frames(sequence_path), "labels": labels}
+
+
+def _parse_labels(label_paths, max_workers):
+    if len(label_paths) < PARALLEL_THRESHOLD or max_workers == 1:
+        return [read_labels(path) for path in label_paths]
+    chunksize = max(1, len(label_paths) // (4 * (max_workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(read_labels, label_paths, chunksize=chunksize))
+
+
+def scan_sequences(root_dir, manifest_path=None, max_workers=None):
+    """
+    List every sequence of `root_dir` that has a labels.csv.
+
+    Args:
+        root_dir (str): Tree laid out as subject/sequence/frames + labels.csv.
+        manifest_path (str): Where to read and update the manifest. None disables caching.
+        max_workers (int): Processes used to parse label files (None = one per CPU).
+
+    Returns:
+        list: (sequence_path, sorted frame names, labels array) tuples, in directory order.
+    """
+    cached = _load_manifest(manifest_path, root_dir) if manifest_path else {}
+    subjects = {}
+    dirty = False
+    pending = []
+
+    for subject in os.listdir(root_dir):
+        subject_path = os.path.join(root_dir, subject)
+        try:
+            subject_stat = os.stat(subject_path)
+        except OSError:
+            continue
+        if not stat.S_ISDIR(subject_stat.st_mode):
+            continue
+
+        previous = cached.get(subject)
+        if previous is not None and previous["mtime_ns"] == subject_stat.st_mtime_ns:
+            names = previous["names"]
+        else:
+            print("Building data for: ", subject_path)
+            names = os.listdir(subject_path)
+            dirty = True
+        previous_sequences = previous["sequences"] if previous is not None else {}
+
+        sequences = {}
+        for sequence in names:
+            old_entry = previous_sequences.get(sequence)
+            entry = _sequence_entry(os.path.join(subject_path, sequence), old_entry)
+            if entry is None:
+                continue
+            dirty |= entry is not old_entry
+            sequences[sequence] = entry
+            if entry["label_key"] is not None and entry["labels"] is None:
+                pending.append((entry, os.path.join(subject_path, sequence, "labels.csv")))
+        subjects[subject] = {"mtime_ns": subject_stat.st_mtime_ns, "names": list(sequences), "sequences": sequences}
+
+    dirty |= set(subjects) != set(cached)
+    if pending:
+        print(f"Parsing {len(pending)} label files.")
+        for (entry, _), labels in zip(pending, _parse_labels([path for _, path in pending], max_workers)):
+            entry["labels"] = labels
+    if manifest_path and dirty:
+        _save_manifest(manifest_path, root_dir, subjects)
+
+    sequences = []
+    for subject, subject_entry in subjects.items():
+        for sequence, entry in subject_entry["sequences"].items():
+            if entry["label_key"] is not None:
+                sequences.append((os.path.join(root_dir, subject, sequence), entry["frames"], entry["labels"]))
+    return sequences
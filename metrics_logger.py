@@ -0,0 +1,148 @@
+"""
+Asynchronous TensorBoard logging for the training loop.
+
+Every `.item()` on a CUDA tensor waits for the device to finish all queued work. The
+training scripts called it once per logged scalar and once per parameter gradient
+norm. They also wrote a histogram of every weight tensor every 25 batches under the
+epoch number, so the same step was rewritten over and over.
+
+`AsyncMetricsLogger` keeps the main thread free of syncs:
+- Scalars stay tensors. Each call stacks them and starts one non-blocking copy to
+  pinned host memory.
+- Gradient norms of all parameters come from one torch._foreach_norm call per
+  device and dtype.
+- Histograms are sampled every `histogram_every` global steps and keyed by that step.
+- A background thread waits for the copies, converts them to numbers and calls the
+  SummaryWriter.
+
+    metrics = AsyncMetricsLogger(writer, histogram_every=500)
+    metrics.log_scalars({"Loss/train": loss, "Correlation/overall": r}, global_step)
+    metrics.log_grad_norms(model.named_parameters(), global_step)
+    metrics.log_histograms(model.named_parameters(), global_step)
+    metrics.close()
+"""
+import queue
+import threading
+import traceback
+from collections import defaultdict
+
+import torch
+
+_STOP = object()
+
+
+class AsyncMetricsLogger:
+    """
+    Queue metrics from the training loop and write them from a background thread.
+
+    Args:
+        writer: SummaryWriter (or anything with add_scalar / add_histogram).
+        histogram_every (int): Global-step cadence of weight histograms (0 disables).
+        max_pending (int): Queued records before the training loop waits for the writer.
+    """
+
+    def __init__(self, writer, histogram_every=500, max_pending=256):
+        self.writer = writer
+        self.histogram_every = histogram_every
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="metrics-logger", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _to_host(tensor):
+        """Start copying `tensor` to host memory; returns (host tensor, event to wait on)."""
+        tensor = tensor.detach()
+        if tensor.device.type != "cuda":
+            # CPU tensors may be updated in place by the next step
+            return tensor.clone(), None
+        host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+        host.copy_(tensor, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record()
+        return host, event
+
+    def log_scalars(self, scalars, step):
+        """Log a dict of tag -> scalar tensor or number with one device-to-host copy."""
+        tags, values = [], []
+        for tag, value in scalars.items():
+            tags.append(tag)
+            values.append(value.detach().float().reshape(()) if torch.is_tensor(value) else torch.tensor(float(value)))
+        if not values:
+            return
+        devices = {value.device for value in values}
+        device = next(iter(devices)) if len(devices) == 1 else torch.device("cpu")
+        host, event = self._to_host(torch.stack([value.to(device) for value in values]))
+        self._queue.put(("scalars", tags, host, event, step))
+
+    def add_scalar(self, tag, value, step):
+        """SummaryWriter-compatible single scalar."""
+        self.log_scalars({tag: value}, step)
+
+    @torch.no_grad()
+    def log_grad_norms(self, named_parameters, step, prefix="Gradients/"):
+        """Log the L2 norm of every parameter gradient, computed with one foreach call per device/dtype."""
+        groups = defaultdict(lambda: ([], []))
+        for name, param in named_parameters:
+            if param.requires_grad and param.grad is not None:
+                names, grads = groups[(param.grad.device, param.grad.dtype)]
+                names.append(prefix + name)
+                grads.append(param.grad)
+        for names, grads in groups.values():
+            norms = torch.stack(torch._foreach_norm(grads)).float()
+            host, event = self._to_host(norms)
+            self._queue.put(("scalars", names, host, event, step))
+
+    @torch.no_grad()
+    def log_histograms(self, named_parameters, step, prefix="Weights/"):
+        """Log weight histograms if `step` is on the histogram cadence. Returns True if logged."""
+        if not self.histogram_every or step % self.histogram_every != 0:
+            return False
+        for name, param in named_parameters:
+            if param.requires_grad:
+                host, event = self._to_host(param)
+                self._queue.put(("histogram", prefix + name, host, event, step))
+        return True
+
+    def print(self, fmt, *args):
+        """print(fmt.format(*args)) from the background thread; tensor arguments are copied asynchronously."""
+        converted = [self._to_host(arg) if torch.is_tensor(arg) else (arg, None) for arg in args]
+        self._queue.put(("print", fmt, converted, None, None))
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            try:
+                if record is _STOP:
+                    return
+                self._write(*record)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def _write(self, kind, key, payload, event, step):
+        if event is not None:
+            event.synchronize()
+        if kind == "scalars":
+            for tag, value in zip(key, payload.tolist()):
+                self.writer.add_scalar(tag, value, step)
+        elif kind == "histogram":
+            self.writer.add_histogram(key, payload, step)
+        elif kind == "print":
+            values = []
+            for value, value_event in payload:
+                if value_event is not None:
+                    value_event.synchronize()
+                values.append(value.item() if torch.is_tensor(value) and value.numel() == 1 else value)
+            print(key.format(*values))
+
+    def flush(self):
+        """Wait until every queued record has been written."""
+        self._queue.join()
+        self.writer.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self.writer.flush()
@@ -0,0 +1,83 @@
+"""
+Mixed-precision training modes shared by the ResNet3D training scripts.
+
+The scripts used to wrap the forward pass, backward pass, gradient clipping and
+optimizer step in the deprecated torch.cuda.amp.autocast(). That context does nothing
+on CPU, and it came with a disabled GradScaler. `Precision` keeps only the forward
+pass under torch.autocast for the training device, on CPU as well as on CUDA. fp16
+uses a real GradScaler: the loss is scaled for backward, and gradients are unscaled
+before clipping, so the clip threshold stays in real units.
+
+    precision = Precision("bf16", device)
+    with precision.autocast():
+        predictions = model(inputs)
+    loss = criterion(predictions.float(), labels)
+    precision.backward(loss)
+    precision.step(optimizer, model.parameters(), max_norm=1.0)
+"""
+import torch
+
+PRECISIONS = ("fp32", "bf16", "fp16")
+_DTYPES = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+class Precision:
+    """
+    Autocast region, loss scaling and optimizer step for one precision mode.
+
+    Args:
+        mode (str): "fp32", "bf16" or "fp16".
+        device: Training device; autocast and the GradScaler use its type.
+        init_scale (float): Initial fp16 loss scale.
+    """
+
+    def __init__(self, mode, device, init_scale=2.0**16):
+        if mode not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{mode}', expected one of {PRECISIONS}.")
+        self.mode = mode
+        self.device_type = torch.device(device).type
+        if mode == "fp16" and self.device_type == "cpu":
+            print("fp16 autocast on CPU has no fast conv3d backward kernels; bf16 is usually much faster.")
+        self.dtype = _DTYPES[mode]
+        self.scaler = torch.amp.GradScaler(self.device_type, init_scale=init_scale, enabled=mode == "fp16")
+        self.stepped = False  # Whether the last `step` updated the parameters
+
+    def autocast(self):
+        """Context for the forward pass (a no-op for fp32)."""
+        return torch.autocast(self.device_type, dtype=self.dtype or torch.float32, enabled=self.dtype is not None)
+
+    def backward(self, loss):
+        self.scaler.scale(loss).backward()
+
+    def step(self, optimizer, parameters=None, max_norm=None, before_clip=None):
+        """
+        Clip (optionally) and step. With fp16 the step is skipped when gradients overflowed,
+        and `stepped` is False until the next step.
+
+        Args:
+            before_clip: Optional callable run on the unscaled gradients before clipping,
+                e.g. L1Penalty.before_clip.
+
+        Returns:
+            torch.Tensor or None: Total gradient norm before clipping, if clipping.
+        """
+        grad_norm = None
+        if max_norm is not None or before_clip is not None:
+            self.scaler.unscale_(optimizer)
+        if before_clip is not None:
+            before_clip()
+        if max_norm is not None:
+            grad_norm = torch.nn.utils.clip_grad_norm_(parameters, max_norm=max_norm)
+        scale = self.scaler.get_scale()
+        self.scaler.step(optimizer)
+        self.scaler.update()
+        # update() lowers the scale only after an overflow, when the step was skipped
+        self.stepped = self.scaler.get_scale() >= scale
+        return grad_norm
+
+    def state_dict(self):
+        return {"mode": self.mode, "scaler": self.scaler.state_dict()}
+
+    def load_state_dict(self, state):
+        if state.get("scaler"):
+            self.scaler.load_state_dict(state["scaler"])
@@ -0,0 +1,125 @@
+"""
+Parallel conversion of full-resolution rendered frames into 64x64 training frames.
+
+This is the Python counterpart of the image part of CreateTrainingDataFromEXRData.m,
+which reads every frame of every subject in turn, imresize's it to 64x64 and
+imwrite's a JPEG into ResnetTraining3/<subject>/<trial>/. Here every (subject, trial)
+is converted in its own process, frames are streamed one at a time, and trials whose
+outputs are newer than their sources are skipped. labels.csv is still written by the
+MATLAB script.
+
+Input frames are named <subject>_trial<N>_frame<M>.png, as in
+vrWalkingdata/frameRecording/<subject>/. Output frames are written as
+<out_dir>/<subject>/<N>/<subject>_trial<N>_frame<M>.jpg, the layout
+StackedFramesDataset reads.
+
+Usage:
+    python preprocess_frames.py --frames-root vrWalkingdata/frameRecording --out-dir ResnetTraining3
+"""
+import argparse
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+SUBJECTS = ["nvp", "nvp7", "nvp8", "nvp10", "nvp9", "yjo2"]
+
+
+def parse_trial(frame_name):
+    """Trial number of a '<subject>_trial<N>_frame<M>.png' name, as a string (as the MATLAB script uses)."""
+    return frame_name.split('_')[1].split('l')[1]
+
+
+def output_name(frame_name):
+    return os.path.splitext(frame_name)[0] + ".jpg"
+
+
+def find_trials(subject_dir):
+    """Group the .png frames of a subject folder by trial, in name order."""
+    trials = defaultdict(list)
+    for name in sorted(os.listdir(subject_dir)):
+        if name.endswith(".png"):
+            trials[parse_trial(name)].append(name)
+    return trials
+
+
+def is_up_to_date(source_dir, frame_names, out_dir):
+    """True if every output frame exists and is newer than its source."""
+    for name in frame_names:
+        try:
+            if os.stat(os.path.join(out_dir, output_name(name))).st_mtime_ns < os.stat(os.path.join(source_dir, name)).st_mtime_ns:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def convert_trial(source_dir, frame_names, out_dir, size=64, quality=75, grayscale=False):
+    """
+    Resize the frames of one trial and write them as JPEGs, one frame at a time.
+
+    Returns:
+        int: Number of frames written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for name in frame_names:
+        with Image.open(os.path.join(source_dir, name)) as image:
+            image = image.convert("L" if grayscale else "RGB")
+            # Bicubic with antialiasing, like MATLAB's imresize default
+            image = image.resize((size, size), Image.BICUBIC)
+        image.save(os.path.join(out_dir, output_name(name)), quality=quality)
+    return len(frame_names)
+
+
+def preprocess(frames_root, out_dir, subjects, size=64, quality=75, grayscale=False, workers=None, force=False):
+    """
+    Convert every trial of `subjects` with a process pool.
+
+    Returns:
+        tuple: (frames written, trials converted, trials skipped).
+    """
+    tasks = []
+    skipped = 0
+    for subject in subjects:
+        subject_dir = os.path.join(frames_root, subject)
+        if not os.path.isdir(subject_dir):
+            print(f"No frames found for {subject} in {subject_dir}.")
+            continue
+        for trial, frame_names in find_trials(subject_dir).items():
+            trial_out = os.path.join(out_dir, subject, trial)
+            if not force and is_up_to_date(subject_dir, frame_names, trial_out):
+                skipped += 1
+                continue
+            tasks.append((subject, trial, subject_dir, frame_names, trial_out))
+
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert_trial, subject_dir, frame_names, trial_out, size, quality, grayscale): (subject, trial)
+                   for subject, trial, subject_dir, frame_names, trial_out in tasks}
+        for future in as_completed(futures):
+            subject, trial = futures[future]
+            count = future.result()
+            written += count
+            print(f"Converted {subject} trial {trial}: {count} frames")
+    return written, len(tasks), skipped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames-root", default="vrWalkingdata/frameRecording", help="Folder holding one folder of rendered frames per subject")
+    parser.add_argument("--out-dir", default="ResnetTraining3", help="Destination subject/trial tree")
+    parser.add_argument("--subjects", nargs="+", default=SUBJECTS)
+    parser.add_argument("--size", type=int, default=64, help="Output width and height")
+    parser.add_argument("--quality", type=int, default=75, help="JPEG quality (MATLAB imwrite default is 75)")
+    parser.add_argument("--grayscale", action="store_true", help="Write single-channel JPEGs")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Convert trials even if their outputs are up to date")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    written, converted, skipped = preprocess(args.frames_root, args.out_dir, args.subjects, size=args.size,
+                                             quality=args.quality, grayscale=args.grayscale,
+                                             workers=args.workers, force=args.force)
+    print(f"Wrote {written} frames from {converted} trials ({skipped} up to date) in {time.perf_counter() - start:.1f}s.")
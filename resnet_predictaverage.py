@@ -1,3 +1,4 @@
+import math
 import os
 import torch
 from torch.utils.data import Dataset, DataLoader
@@ -18,75 +19,200 @@ import matplotlib.pyplot as plt
 #from torch.optim.lr_scheduler import CosineAnnealingLR
 from torch.optim.lr_scheduler import SequentialLR, LambdaLR, CosineAnnealingLR
 from torch.optim.lr_scheduler import CosineAnnealingWarmRestarts
+from frame_cache import FrameCache, WorkerCacheStats
+from frame_store import PackedFrames, load_packed_sequences
+from manifest import default_manifest_path, scan_sequences
+from samplers import ChunkedShuffleBatchSampler
+from augment import StackAugment
+from label_codec import LabelCodec, window_medians
+from decoders import get_decoder, select_decoder
+from splits import RangeSubset, group_split, shard_ranges
+from collate import INPUT_SCALE, stack_collate, to_model_input
+from precision import PRECISIONS, Precision
+from execution import COMPILE_MODES, prepare_model, to_memory_format, warm_up
+from l1_penalty import L1_MODES, L1Penalty
+from metrics_logger import AsyncMetricsLogger
+from figure_worker import FigureWorker, figure_record, plot_predicted_vs_actual
+from streaming_metrics import RegressionAccumulator, ReservoirSample
+from evaluate import deterministic_view, eval_loader, evaluate
+from distributed import (all_reduce_mean, all_reduce_min, broadcast_buffers, cleanup, get_rank, get_world_size, init_distributed,
+                         is_main_process, no_sync, resolve_device)
+from batch_probe import max_micro_batch
+from activation_checkpoint import parse_checkpoint_blocks, run_block
+from step_profiler import StepProfiler
+from checkpointing import AsyncCheckpointer, latest_checkpoint, load_checkpoint, restore_training_state, training_state
 
 class StackedFramesDataset(Dataset):
-    def __init__(self, root_dir, transform=None, frames_per_stack=20):
+    def __init__(self, root_dir, transform=None, frames_per_stack=20, packed_dir=None, cache_bytes=0,
+                 use_manifest=True, manifest_path=None, label_codec=None, decoder="pil", as_uint8=False):
         self.root_dir = root_dir
         self.transform = transform
         self.frames_per_stack = frames_per_stack
-        self.data = []  # Store paths to image sequences and labels
+        self.packed_dir = packed_dir  # Optional store written by frame_store.py
+        self.use_manifest = use_manifest  # Cache the directory scan and parsed labels between runs
+        self.manifest_path = manifest_path  # Defaults to a file inside root_dir
+        self.label_codec = label_codec  # Optional LabelCodec applied once to the window medians
+        self.as_uint8 = as_uint8  # Without a transform, return raw uint8 stacks and normalize on the device
+        # Decoded frames shared by overlapping windows; every DataLoader worker gets its own copy
+        self.frame_cache = FrameCache(cache_bytes) if cache_bytes > 0 else None
+        self.data = []  # Store paths to image sequences (or packed frames) and labels
+        self.sequence_names = []  # "subject/sequence" of every entry of self.data
 
         # Load image sequences and corresponding labels
         self._load_sequences()
 
+        # Image decoder backend; "auto" picks the fastest one that matches PIL pixel for pixel
+        self.decoder = self._sample_decoder() if decoder == "auto" else decoder
+        self._decode = get_decoder(self.decoder)
+
     def _load_sequences(self):
-        # Traverse the directory structure to find image folders and labels.txt
-        for subject in os.listdir(self.root_dir):
-            subject_path = os.path.join(self.root_dir, subject)
-            print("Building data for: ", subject_path)
-            if os.path.isdir(subject_path):
-                for sequence in os.listdir(subject_path):
-                    sequence_path = os.path.join(subject_path, sequence)
-                    if os.path.isdir(sequence_path):
-                        # Load images
-                        frames = sorted(
-                            [os.path.join(sequence_path, f) for f in os.listdir(sequence_path) if f.endswith(('.png', '.jpg'))]
-                        )
-                        # Load labels
-                        label_path = os.path.join(sequence_path, "labels.csv")
-                        if os.path.exists(label_path):
-                            labels = pd.read_csv(label_path, sep=",")  # Load 2D labels
-                            labels = labels.apply(pd.to_numeric, errors='coerce')
-                            labels = labels.fillna(0)
-                            labels = labels.to_numpy()
-                            if len(frames) == len(labels):  # Frames and labels must match exactly
-                                self.data.append((frames, labels))
-                            else:
-                                print(f"Mismatch in frames ({len(frames)}) and labels ({len(labels)}) in {sequence_path}.")
+        if self.packed_dir is not None:
+            # Frames were decoded ahead of time into one memory-mapped array per sequence
+            print("Loading packed data from: ", self.packed_dir)
+            self.data = load_packed_sequences(self.packed_dir)
+            self.sequence_names = [os.path.relpath(os.path.dirname(frames.path), self.packed_dir).replace(os.sep, "/")
+                                   for frames, _ in self.data]
+        else:
+            self._scan_sequences()
+
+        self._build_index()
+        self._build_targets()
+
+    def _scan_sequences(self):
+        # Traverse the directory structure to find image folders and labels.csv, reusing the
+        # manifest for every folder that has not changed since the last run
+        manifest_path = None
+        if self.use_manifest:
+            manifest_path = self.manifest_path or default_manifest_path(self.root_dir)
+        for sequence_path, frame_names, labels in scan_sequences(self.root_dir, manifest_path):
+            frames = [os.path.join(sequence_path, f) for f in frame_names]
+            if len(frames) == len(labels):  # Frames and labels must match exactly
+                self.data.append((frames, labels))
+                self.sequence_names.append(os.path.relpath(sequence_path, self.root_dir).replace(os.sep, "/"))
+            else:
+                print(f"Mismatch in frames ({len(frames)}) and labels ({len(labels)}) in {sequence_path}.")
+
+    def _build_index(self):
+        """
+        Precompute the cumulative window offsets of every sequence in `self.data`.
+
+        `self._offsets[i]` is the flat index of the first window of sequence i, and
+        `self._offsets[-1]` is the total number of windows. Sequences shorter than
+        `frames_per_stack` contribute no windows.
+        """
+        num_stacks = [max(len(frames) - self.frames_per_stack, 0) for frames, _ in self.data]
+        self._offsets = np.zeros(len(num_stacks) + 1, dtype=np.int64)
+        np.cumsum(num_stacks, out=self._offsets[1:])
+        self._length = int(self._offsets[-1])
+
+    def _build_targets(self):
+        """
+        Precompute the median label of every window, encoded with `label_codec` if set.
+
+        `self._targets[i][j]` is the target of the window starting at frame j of sequence i.
+        """
+        self._targets = []
+        for frames, labels in self.data:
+            medians = window_medians(labels, self.frames_per_stack)
+            if self.label_codec is not None:
+                medians = self.label_codec.encode(medians).astype(np.float32)
+            self._targets.append(medians)
+
+    def _sample_decoder(self, num_samples=32):
+        # Benchmark the decoders on frames spread over the sequences
+        sequences = [frames for frames, _ in self.data if not isinstance(frames, PackedFrames) and len(frames) > 0]
+        picks = np.linspace(0, len(sequences) - 1, min(num_samples, len(sequences))).astype(int) if sequences else []
+        decoder = select_decoder([sequences[i][len(sequences[i]) // 2] for i in picks])
+        print("Using image decoder: ", decoder)
+        return decoder
+
+    def split(self, by="sequence", val_fraction=0.1, seed=0):
+        """
+        Split whole sequences, or whole subjects, into train and validation.
+
+        Args:
+            by (str): "sequence" or "subject".
+            val_fraction (float): Target fraction of windows in validation.
+            seed (int): Seed of the assignment.
+
+        Returns:
+            tuple: (train_ranges, val_ranges) of [start, stop) window indices, for
+                RangeSubset or ChunkedShuffleBatchSampler.
+        """
+        if by == "sequence":
+            groups = self.sequence_names
+        elif by == "subject":
+            groups = [name.split("/")[0] for name in self.sequence_names]
+        else:
+            raise ValueError(f"Unknown split '{by}', expected 'sequence' or 'subject'.")
+        return group_split(groups, self._offsets, val_fraction, seed)
+
+    @property
+    def sequence_offsets(self):
+        """Cumulative window offsets; windows of sequence i are [offsets[i], offsets[i + 1])."""
+        return self._offsets
+
+    def _locate(self, idx):
+        """
+        Map a flat window index to (sequence index, first frame of the window) by
+        binary search over the cumulative offsets.
+        """
+        if idx < 0:
+            idx += self._length
+        if idx < 0 or idx >= self._length:
+            raise IndexError("Index out of range.")
+        seq_idx = int(np.searchsorted(self._offsets, idx, side='right')) - 1
+        return seq_idx, int(idx - self._offsets[seq_idx])
 
     def __len__(self):
-        return sum(len(frames) - self.frames_per_stack for frames, _ in self.data)
+        return self._length
 
     def __getitem__(self, idx):
         # Find the sequence and corresponding stack based on index
-        for frames, labels in self.data:
-            num_stacks = len(frames) - self.frames_per_stack
-            if idx < num_stacks:
-                # Get the image paths and labels for the current stack
-                stack_frames = frames[idx:idx + self.frames_per_stack]
-                stack_labels = labels[idx:idx + self.frames_per_stack]
-
-                # Load and preprocess images
-                images = []
-                for frame_path in stack_frames:
-                    image = Image.open(frame_path).convert("L")  # Convert to grayscale
-                    if self.transform:
-                        image = self.transform(image)
-                    images.append(torch.from_numpy(np.array(image, dtype=np.float32) / 255.0).unsqueeze(0))  # Add channel dim
-
-                # Stack images into a 5D tensor: (frames_per_stack, 1, H, W)
-                images_stack = torch.stack(images, dim=0)
-
-                # Convert stack labels to a tensor and compute the median motion
-                stack_labels_tensor = torch.tensor(stack_labels, dtype=torch.float32)
-                median_labels = torch.median(stack_labels_tensor, dim=0).values  # Median along the temporal dimension
-
-                # Return image stack and median motion vector
-                return images_stack, median_labels
+        seq_idx, idx = self._locate(idx)
+        frames, _ = self.data[seq_idx]
+
+        # Get the image paths for the current stack
+        stack_frames = frames[idx:idx + self.frames_per_stack]
+
+        if isinstance(frames, PackedFrames):
+            # Zero-copy uint8 slice of the memory-mapped sequence
+            stack_pixels = stack_frames
+        else:
+            stack_pixels = [self._read_frame(frame_path) for frame_path in stack_frames]
+
+        if not self.transform:
+            stack = np.stack(stack_pixels)
+            if self.as_uint8:
+                # Raw frames (frames_per_stack, H, W), a quarter of the float32 bytes
+                images_stack = torch.from_numpy(stack)
             else:
-                idx -= num_stacks
-
-        raise IndexError("Index out of range.")
+                # Stack images into a 4D tensor: (frames_per_stack, 1, H, W), at the model's input scale
+                images_stack = torch.from_numpy(stack.astype(np.float32) * INPUT_SCALE).unsqueeze(1)
+        else:
+            # Augmentations run after the cache lookup so every window still gets fresh randomness
+            images = []
+            for pixels in stack_pixels:
+                image = self.transform(Image.fromarray(pixels))
+                # ToTensor already divided by 255; this division completes INPUT_SCALE
+                images.append(torch.from_numpy(np.array(image, dtype=np.float32) / 255.0).unsqueeze(0))  # Add channel dim
+
+            # Stack images into a 5D tensor: (frames_per_stack, 1, H, W)
+            images_stack = torch.stack(images, dim=0)
+
+        # Return image stack and median motion vector
+        return images_stack, torch.from_numpy(self._targets[seq_idx][idx])
+
+    def _read_frame(self, frame_path):
+        # Decode a frame to a grayscale uint8 array, going through the frame cache if enabled
+        if self.frame_cache is not None:
+            pixels = self.frame_cache.get(frame_path)
+            if pixels is not None:
+                return pixels
+        pixels = self._decode(frame_path)  # Grayscale uint8
+        if self.frame_cache is not None:
+            self.frame_cache.put(frame_path, pixels)
+        return pixels
 
     
 def add_noise(img):
@@ -129,13 +255,14 @@ class EnergyBasedResNet3D(nn.Module):
 
 
 class ResNet3D(nn.Module):
-    def __init__(self, num_classes=9, num_frames=20, kernel_size=(5, 3, 3), dropout_prob=0.05):
+    def __init__(self, num_classes=9, num_frames=20, kernel_size=(5, 3, 3), dropout_prob=0.05, checkpoint_blocks=()):
         super(ResNet3D, self).__init__()
 
         # Define padding to retain the spatial and temporal dimensions
         temporal_padding = (kernel_size[0] // 2, kernel_size[1] // 2, kernel_size[2] // 2)  # Centered padding
 
         self.num_frames = num_frames
+        self.checkpoint_blocks = tuple(checkpoint_blocks)  # Activation checkpointing, see activation_checkpoint.py
 
         # Define the layers with the new kernel size
         self.layer1 = nn.Sequential(
@@ -192,12 +319,12 @@ class ResNet3D(nn.Module):
         self.fc = nn.Linear(1024, num_classes)  # Adjust for the reduced depth
 
     def forward(self, x):
-        # Pass input through the layers
-        x = self.layer1(x)
-        x = self.layer2(x)
-        x = self.layer3(x)
-        x = self.layer4(x)
-        x = self.layer5(x)
+        # Pass input through the layers; blocks in checkpoint_blocks are recomputed during backward
+        x = run_block(self.layer1, x, "layer1" in self.checkpoint_blocks)
+        x = run_block(self.layer2, x, "layer2" in self.checkpoint_blocks)
+        x = run_block(self.layer3, x, "layer3" in self.checkpoint_blocks)
+        x = run_block(self.layer4, x, "layer4" in self.checkpoint_blocks)
+        x = run_block(self.layer5, x, "layer5" in self.checkpoint_blocks)
         #x = self.layer6(x)
         x = self.layer7(x)  # Output shape: [batch_size, channels, frames, 1, 1]
 
@@ -367,80 +494,28 @@ def log_mse_per_parameter(writer, epoch, predictions, ground_truth, tag="mse"):
         # Compute MSE for the current parameter
         mse = torch.nn.functional.mse_loss(pred_param, gt_param)
 
-        # Log MSE for this parameter
-        writer.add_scalar(f"{tag}/param_{param_idx}", mse.item(), epoch)
+        # Log MSE for this parameter (as a tensor, so an asynchronous logger does not sync)
+        writer.add_scalar(f"{tag}/param_{param_idx}", mse.detach(), epoch)
 
 
 def visualize_predicted_vs_actual(pred_translation, translation_labels, pred_rotation, rotation_labels, writer, global_step, label_="train"):
     """
     Visualize predicted vs actual values for translation and rotation with line fit and R^2 score.
 
+    Draws synchronously; the training loop hands figures to a FigureWorker instead.
+
     Parameters:
-    - pred_translation: Predicted translation values (batch_size, seq_len, 3).
-    - translation_labels: Ground truth translation values (batch_size, seq_len, 3).
-    - pred_rotation: Predicted rotation values (batch_size, seq_len, 3).
-    - rotation_labels: Ground truth rotation values (batch_size, seq_len, 3).
+    - pred_translation: Predicted translation values (batch_size, 3).
+    - translation_labels: Ground truth translation values (batch_size, 3).
+    - pred_rotation: Predicted rotation values (batch_size, 3).
+    - rotation_labels: Ground truth rotation values (batch_size, 3).
     - writer: TensorBoard SummaryWriter instance.
     - global_step: Global step for TensorBoard logging.
     """
-    from sklearn.metrics import r2_score
-    from sklearn.linear_model import LinearRegression
-    def plot_with_fit(ax, y_pred, y_true, title, xlabel, ylabel):
-        # Flatten data
-        y_pred_flat = y_pred.flatten()
-        y_true_flat = y_true.flatten()
-
-        # Line fit using linear regression
-        print (y_pred_flat.shape, y_true_flat.shape)
-        reg = LinearRegression().fit(y_true_flat.reshape(-1, 1), y_pred_flat)
-        #slope, intercept, r_value, p_value, std_err = scipy.stats.linregress(y_true_flat.reshape(-1, 1), y_pred_flat)
-        r2 = r2_score(y_true_flat, y_pred_flat)
-        line_x = np.linspace(y_true_flat.min(), y_true_flat.max(), 100)
-        line_y = reg.predict(line_x.reshape(-1, 1))
-
-        # Plot scatter and line
-        ax.scatter(y_true_flat, y_pred_flat, alpha=0.5, label="Data")
-        ax.plot(line_x, line_y, color='red', label=f"Line Fit (R²={r2:.2f})")
-        ax.set_title(title)
-        ax.set_xlabel(xlabel)
-        ax.set_ylabel(ylabel)
-        ax.legend()
-
-    # Convert tensors to NumPy arrays
-    pred_translation = pred_translation#.squeeze(0)#.cpu().detach().numpy()
-    translation_labels = translation_labels#.cpu().detach().numpy()
-    pred_rotation = pred_rotation#.squeeze(0)#.cpu().detach().numpy()
-    rotation_labels = rotation_labels#.cpu().detach().numpy()
-    pred_translation = torch.tensor(pred_translation, device="cuda" if torch.cuda.is_available() else "cpu")
-    pred_rotation = torch.tensor(pred_rotation, device="cuda" if torch.cuda.is_available() else "cpu")
-    pred_translation = torch.where(torch.isnan(pred_translation), torch.tensor(0.0, device=pred_translation.device), pred_translation)
-    pred_translation = torch.where(torch.isinf(pred_translation), torch.tensor(0.0, device=pred_translation.device), pred_translation)
-    pred_rotation = torch.where(torch.isnan(pred_rotation), torch.tensor(0.0, device=pred_rotation.device), pred_rotation)
-    pred_rotation = torch.where(torch.isinf(pred_rotation), torch.tensor(0.0, device=pred_rotation.device), pred_rotation)    
-    pred_rotation = pred_rotation.cpu().detach().numpy()
-    pred_translation = pred_translation.cpu().detach().numpy()
-    fig, axes = plt.subplots(2, 3, figsize=(18, 10))
-    print (pred_rotation.shape, rotation_labels.shape)
-    print (pred_translation.shape, translation_labels.shape)
-    # Plot translation components
-    for i, label in enumerate(["X", "Y", "Z"]):
-        plot_with_fit(
-            axes[0, i], pred_translation[..., i], translation_labels[..., i],
-            title=f"Translation {label}: Predicted vs Actual",
-            xlabel="Actual",
-            ylabel="Predicted"
-        )
-
-    # Plot rotation components
-    for i, label in enumerate(["Roll", "Pitch", "Yaw"]):
-        plot_with_fit(
-            axes[1, i], pred_rotation[..., i], rotation_labels[..., i],
-            title=f"Rotation {label}: Predicted vs Actual",
-            xlabel="Actual",
-            ylabel="Predicted"
-        )
-
-    plt.tight_layout()
+    predictions = torch.cat([torch.as_tensor(pred_translation), torch.as_tensor(pred_rotation)], dim=-1)
+    labels = torch.cat([torch.as_tensor(translation_labels), torch.as_tensor(rotation_labels)], dim=-1)
+    # Line fit and R² of all six components in one vectorized pass
+    fig = plot_predicted_vs_actual(*figure_record(predictions, labels))
 
     # Save to TensorBoard
     writer.add_figure(label_+"Predicted vs Actual (with Fit)", fig, global_step)
@@ -466,10 +541,10 @@ def variability_loss(predictions, alpha=0.25):
     # Step 2: Compute the mean variance across all parameters
     mean_variance = torch.mean(variance) * alpha
     if mean_variance < 1e-6:
-        mean_variance = -torch.tensor(20, dtype=torch.float32, device="cuda", requires_grad=True)
+        mean_variance = -torch.tensor(20, dtype=torch.float32, device=predictions.device, requires_grad=True)
 
     elif mean_variance > 20:
-        mean_variance = torch.tensor(20, dtype=torch.float32, device="cuda", requires_grad=True)
+        mean_variance = torch.tensor(20, dtype=torch.float32, device=predictions.device, requires_grad=True)
 
     loss = mean_variance 
     return loss
@@ -479,10 +554,49 @@ def zero_penalty_loss(pred, weight=0.05):
     return penalty
 
 if __name__ == '__main__':
-    from torch.amp import GradScaler
+    import argparse
     from torch.utils.tensorboard import SummaryWriter
-    from sklearn.model_selection import train_test_split
-    from torch.utils.data import DataLoader, Subset
+    from torch.utils.data import DataLoader
+
+    parser = argparse.ArgumentParser(description="Train the ResNet3D head-motion model.")
+    parser.add_argument('--root-dir', default='TrainingData2/', help="Training tree laid out as subject/sequence/frames + labels.csv")
+    parser.add_argument('--packed-dir', default=None, help="Read frames from a store built by frame_store.py instead of decoding images")
+    parser.add_argument('--frame-cache-mb', type=float, default=0, help="Per-worker LRU cache of decoded frames, in MB (0 disables)")
+    parser.add_argument('--chunk-size', type=int, default=64, help="Contiguous windows shuffled together and loaded by one worker (1 = full shuffle)")
+    parser.add_argument('--augment', choices=['batch', 'frame'], default='batch', help="'batch': StackAugment on whole batches, 'frame': per-frame PIL transforms in the workers")
+    parser.add_argument('--device', default='auto', help="'auto' (the local rank's GPU, else CPU), 'cpu', 'cuda' or e.g. 'cuda:1'")
+    parser.add_argument('--batch-size', type=int, default=4, help="Micro-batch size of each forward/backward pass")
+    parser.add_argument('--accumulate', type=int, default=1, help="Micro-batches whose gradients are accumulated into one optimizer step")
+    parser.add_argument('--activation-checkpointing', default='none', help="Blocks recomputed in backward to save memory: 'none', 'early' (layer1-2), 'all' or e.g. 'layer1,layer3'")
+    parser.add_argument('--auto-batch-size', action='store_true', help="Use the largest micro-batch whose training step fits --memory-budget-mb")
+    parser.add_argument('--memory-budget-mb', type=float, default=0, help="Memory for a training step (0: 90%% of free GPU memory, or half of the free RAM)")
+    parser.add_argument('--split-by', choices=['sequence', 'subject'], default='sequence', help="Keep whole sequences or whole subjects on one side of the train/val split")
+    parser.add_argument('--decoder', choices=['auto', 'pil', 'pil_draft', 'cv2', 'torchvision'], default='pil', help="Image decoder; 'auto' picks the fastest one identical to PIL")
+    parser.add_argument('--precision', choices=PRECISIONS, default='fp32', help="'bf16': bfloat16 autocast (CPU or GPU), 'fp16': float16 autocast with loss scaling")
+    parser.add_argument('--channels-last', action='store_true', help="Run the model in channels_last_3d memory format")
+    parser.add_argument('--compile', action='store_true', help="torch.compile the model (compiled graphs are cached under .cache/torchinductor)")
+    parser.add_argument('--compile-mode', choices=COMPILE_MODES, default='default')
+    parser.add_argument('--l1-mode', choices=L1_MODES, default='gradient', help="'gradient': add lambda*sign(w) to the gradients, 'proximal': soft-threshold weights after each step")
+    parser.add_argument('--histogram-every', type=int, default=500, help="Global steps between weight histograms (0 disables)")
+    parser.add_argument('--plot-samples', type=int, default=2000, help="Predictions kept (uniformly sampled) for the predicted-vs-actual scatter plots")
+    parser.add_argument('--augment-on', choices=['device', 'cpu'], default='device', help="Where batched augmentation runs")
+    parser.add_argument('--eval-batch-size', type=int, default=64, help="Batch size of the validation pass")
+    parser.add_argument('--eval-workers', type=int, default=4, help="DataLoader workers of the validation pass")
+    parser.add_argument('--checkpoint-dir', default='Resnet_models', help="Where full training-state checkpoints are written")
+    parser.add_argument('--checkpoint-every', type=int, default=0, help="Also checkpoint every N optimizer steps within an epoch (0 = end of epoch only)")
+    parser.add_argument('--keep-last', type=int, default=3, help="Most recent checkpoints to keep (0 keeps all)")
+    parser.add_argument('--keep-best', type=int, default=1, help="Checkpoints with the lowest validation loss to keep in addition")
+    parser.add_argument('--resume', default=None, help="Checkpoint to resume from, or 'auto' for the latest one in --checkpoint-dir")
+    parser.add_argument('--profile', action='store_true', help="Time data wait, host-to-device, forward, backward, optimizer and logging per step (Profile/ in TensorBoard)")
+    parser.add_argument('--profile-trace-start', type=int, default=10, help="Steps before the torch.profiler trace window")
+    parser.add_argument('--profile-trace-steps', type=int, default=5, help="Steps traced by torch.profiler into the TensorBoard run directory (0 disables)")
+    args = parser.parse_args()
+    # One process per device; under launch.py (or torchrun) every process is a DDP rank
+    device = resolve_device(args.device)
+    distributed = init_distributed(device)
+    rank, world_size = get_rank(), get_world_size()
+    is_main = is_main_process()
+    precision = Precision(args.precision, device)
 
     #torch.manual_seed(1324)
     train_transforms = transforms.Compose([
@@ -493,187 +607,273 @@ if __name__ == '__main__':
         transforms.ToTensor(),
         transforms.Lambda(add_noise) 
     ])
-    # Initialize the GradScaler
-    #scaler = GradScaler(init_scale=8.0, device='cuda')
-    scaler = GradScaler(enabled=False)
-    dataset = StackedFramesDataset(root_dir='TrainingData2/', frames_per_stack=20, transform = train_transforms)
+    # Targets are the median labels of each window, selected, scaled and log-compressed once at load time
+    label_codec = LabelCodec(columns=[1, 2, 3, 4, 8, 9], scale=100.0)
+    dataset = StackedFramesDataset(root_dir=args.root_dir, frames_per_stack=20, transform = train_transforms if args.augment == 'frame' else None, packed_dir=args.packed_dir,
+                                   cache_bytes=int(args.frame_cache_mb * 2**20), label_codec=label_codec, decoder=args.decoder,
+                                   as_uint8=args.augment == 'batch')
     print ("Splitting data into train and validation.")
-    indices = list(range(len(dataset)))
-    train_indices, val_indices = train_test_split(indices, test_size=0.1, random_state=5205)
+    # Whole sequences (or subjects) go to one side, so overlapping windows never straddle the split
+    train_ranges, val_ranges = dataset.split(by=args.split_by, val_fraction=0.1, seed=5205)
     num_workers = 12
-    num_outputs = 6
+    num_outputs = label_codec.num_outputs
     print ("Number of workers: ", num_workers)
-    # Create subset datasets
-    train_dataset = Subset(dataset, train_indices)
-    val_dataset = Subset(dataset, val_indices)
-    batch_size = 4
-    data_loader = DataLoader(
-        train_dataset,
+    # Validation reads every held-out window in order, without augmentation
+    # Each rank evaluates its own contiguous share of the held-out windows
+    val_dataset = RangeSubset(deterministic_view(dataset), shard_ranges(val_ranges, world_size, rank))
+    print("Validation samples: ", len(val_dataset))
+    checkpoint_blocks = parse_checkpoint_blocks(args.activation_checkpointing)
+    batch_size = args.batch_size  # Micro-batch; --accumulate micro-batches make one optimizer step
+    if args.auto_batch_size:
+        # Largest micro-batch whose forward/backward fits the memory budget; all ranks use the smallest
+        probe_model = prepare_model(ResNet3D(num_classes=num_outputs, checkpoint_blocks=checkpoint_blocks).to(device), channels_last=args.channels_last)
+        batch_size = max_micro_batch(probe_model, (20,) + tuple(dataset[0][0].shape[-2:]), device, precision, args.channels_last,
+                                     budget=int(args.memory_budget_mb * 2**20) or None)
+        batch_size = int(all_reduce_min(torch.tensor(batch_size, device=device)).item())
+        del probe_model
+        print(f"Micro-batch size: {batch_size}, accumulated over {args.accumulate}")
+    # Shuffle contiguous chunks of windows so each worker reads neighbouring frames
+    train_sampler = ChunkedShuffleBatchSampler(
+        train_ranges,
         batch_size=batch_size,
-        shuffle=True,
+        chunk_size=args.chunk_size,
+        num_workers=num_workers,
+        seed=5205,
+        num_replicas=world_size,  # Ranks train on disjoint slices of the same permutation
+        rank=rank,
+    )
+    # Each training worker's frame cache counters, in shared memory so they can be logged every epoch
+    cache_stats = WorkerCacheStats(num_workers, dataset) if dataset.frame_cache is not None else None
+    data_loader = DataLoader(
+        dataset,
+        batch_sampler=train_sampler,
+        collate_fn=stack_collate,  # Contiguous [batch_size, 1, frames_per_stack, H, W] batches
         num_workers=num_workers,
         pin_memory=True,
         persistent_workers=True,
-        prefetch_factor=8  # Default is 2, increasing can help
+        prefetch_factor=8,  # Default is 2, increasing can help
+        worker_init_fn=cache_stats.worker_init_fn if cache_stats is not None else None,
+        # Worker seeds come from a separate generator, so the global RNG saved in checkpoints is only used by training
+        generator=torch.Generator().manual_seed(torch.initial_seed()),
     )
-    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=True)
+    val_loader = eval_loader(val_dataset, batch_size=args.eval_batch_size, num_workers=args.eval_workers)
     print("Total number of batches:", len(data_loader))
-    print("Total number of samples:", len(data_loader.dataset))
+    print("Total number of samples:", train_sampler.num_samples)
     # Set up the model, loss, and optimizer
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     #model = ResNet3D(num_classes=num_outputs, dropout_prob=0.25).to(device)
     #model.apply(initialize_weights)
     # Initialize the energy-based model
-    energy_model = ResNet3D(num_classes=num_outputs, dropout_prob=0.5).to(device)
+    energy_model = ResNet3D(num_classes=num_outputs, dropout_prob=0.5, checkpoint_blocks=checkpoint_blocks).to(device)
+    batch_augment = StackAugment() if args.augment == 'batch' else None
+    augment_device = device if args.augment_on == 'device' else torch.device("cpu")
     #energy_model = EnergyBasedResNet3D(base_model, feature_dim=1024, num_outputs=num_outputs).to(device)
     energy_model.apply(initialize_weights)
+    # Optional channels_last_3d / torch.compile; forward_model shares its parameters with energy_model
+    forward_model = prepare_model(energy_model, channels_last=args.channels_last, compile=args.compile, compile_mode=args.compile_mode,
+                                  distributed=distributed)
+    # Evaluation is rank-local and skips DDP, whose forward would wait on ranks with more batches
+    eval_model = prepare_model(energy_model, channels_last=args.channels_last, compile=args.compile,
+                               compile_mode=args.compile_mode) if distributed else forward_model
+    if args.compile:
+        # Compile the training and evaluation graphs before the first epoch
+        frame_shape = tuple(dataset[0][0].shape[-2:])
+        for train_mode in (True, False):
+            warm_shape = (batch_size if train_mode else args.eval_batch_size, 1, 20) + frame_shape
+            compile_time = warm_up(forward_model if train_mode else eval_model, warm_shape, device, precision, train=train_mode, channels_last=args.channels_last)
+            print(f"Compiled {'training' if train_mode else 'evaluation'} graph in {compile_time:.1f}s")
     # Optimizer and scheduler
     optimizer = torch.optim.SGD(energy_model.parameters(), momentum=0.9, lr=1e-4, weight_decay=1e-4)
+    lambda_l1 = 1e-4
+    # L1 is applied by the optimizer step instead of autograd; the loss is divided by 10 before backward
+    l1_penalty = L1Penalty(optimizer, lambda_l1 / 10.0, mode=args.l1_mode)
     #scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', patience=2, factor=0.5)
     #scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.9)
     num_epochs = 50
+    accumulate = args.accumulate
+    steps_per_epoch = math.ceil(len(data_loader) / accumulate)  # Optimizer steps, which is what the schedule counts
     scheduler = torch.optim.lr_scheduler.OneCycleLR(
         optimizer,
         max_lr=1e-3,  # Peak LR
-        steps_per_epoch=len(data_loader),
+        steps_per_epoch=steps_per_epoch,
         epochs=num_epochs,
         pct_start=0.1,  # 10% of training for warmup
     )
     
-    writer = SummaryWriter('runs/experiment6')
+    # Only rank 0 logs, draws figures and writes checkpoints
+    writer = SummaryWriter('runs/experiment6') if is_main else None
+    # Scalars, gradient norms and histograms are written from a background thread
+    metrics = AsyncMetricsLogger(writer, histogram_every=args.histogram_every) if is_main else None
+    # Predicted-vs-actual figures are drawn in a separate process
+    figures = FigureWorker(writer.get_logdir()) if is_main else None
+    # Full training state is written from a background thread; old checkpoints are pruned
+    checkpointer = AsyncCheckpointer(args.checkpoint_dir, keep_last=args.keep_last, keep_best=args.keep_best) if is_main else None
+    start_epoch, start_batch = 0, 0
+    if args.resume:
+        resume_path = latest_checkpoint(args.checkpoint_dir) if args.resume == 'auto' else args.resume
+        if resume_path is None:
+            print("No checkpoint to resume from in", args.checkpoint_dir)
+        else:
+            state = load_checkpoint(resume_path)  # Memory-mapped
+            if "optimizer" in state:
+                start_epoch, start_batch, _ = restore_training_state(state, energy_model, optimizer, scheduler, precision)
+                print(f"Resuming from {resume_path} at epoch {start_epoch + 1}, batch {start_batch}")
+            else:
+                energy_model.load_state_dict(state)  # Weights-only file from an older run
+                print(f"Loaded weights from {resume_path}")
+            del state
     criterion = nn.MSELoss(reduction='mean')#nn.HuberLoss(delta=1.0, reduction='mean')
     # Training loop
     
     log_interval = 25
-    for epoch in range(num_epochs):
+    # Full-epoch statistics in O(1) memory, plus a fixed-size sample of points for the figures
+    train_stats, val_stats = RegressionAccumulator(num_outputs, device), RegressionAccumulator(num_outputs, device)
+    train_sample, val_sample = ReservoirSample(args.plot_samples, seed=5205), ReservoirSample(args.plot_samples, seed=5205)
+    # Opt-in stage timers and torch.profiler trace on rank 0; a no-op without --profile
+    profiler = StepProfiler(args.profile and is_main, device, writer, writer.get_logdir() if is_main else None,
+                            trace_start=args.profile_trace_start, trace_steps=args.profile_trace_steps, log_every=log_interval)
+    for epoch in range(start_epoch, num_epochs):
+        # A resumed epoch continues with the batches it had not trained on
+        first_batch = start_batch if epoch == start_epoch else 0
+        train_sampler.set_epoch(epoch, start_batch=first_batch)
         energy_model.train()
-        total_loss = 0.0
-        predictionsList = []
-        labs = []
-        for batch_idx, (inputs, labels) in enumerate(data_loader):
+        total_loss = torch.zeros((), device=device)  # Accumulated on the device, read once per epoch
+        train_stats.reset()
+        train_sample.reset()
+        for batch_idx, (inputs, labels) in enumerate(profiler.iterate(data_loader), start=first_batch):
             
-            images_stack = inputs.squeeze(2)#torch.stack(images_stack, dim=0)  # Shape: [frames_per_stack, 1, H, W]
-            labels = labels + torch.randn_like(labels) * 0.02
-            labels = labels[:,[1,2,3,4,8,9]] * 100
-            inputs, labels = images_stack.to(device), labels.to(device)
-            labels = torch.sign(labels) * torch.log1p(torch.abs(labels)) 
+            # inputs: [batch_size, 1, frames_per_stack, H, W], uint8 unless per-frame transforms are used
+            with profiler.stage("h2d"):
+                if batch_augment is not None:
+                    # One rotation and blur per stack, in the main process or on the training device
+                    inputs = batch_augment(to_model_input(inputs, augment_device))
+                inputs, labels = to_model_input(inputs, device), labels.to(device, non_blocking=True)
+                labels = label_codec.perturb(labels, 0.02)  # Label noise in the original units
             
             # Generate negative samples
             #negative_labels = generate_negative_samples(labels)
 
-            inputs = inputs.permute(0, 2, 1, 3, 4)
+            # Gradients of `micro_batches` micro-batches are averaged into one optimizer step
+            window_start = batch_idx - batch_idx % accumulate
+            micro_batches = min(accumulate, len(data_loader) - window_start)
+            stepped = batch_idx + 1 == window_start + micro_batches
 
-            # Zero gradients
-            optimizer.zero_grad()
+            # Zero gradients at the start of each accumulation window
+            if batch_idx == window_start or batch_idx == first_batch:
+                optimizer.zero_grad()
 
             #print ("inputs shape: ", inputs.shape, " labels shape: ", labels.shape)
 
-            # Compute energy-based loss
-            with torch.cuda.amp.autocast():
-                #loss, predictions = energy_loss(energy_model, inputs, labels, negative_labels)
-                predictions = energy_model(inputs)
-                loss = criterion(predictions, labels)*(10)
-                r, corr_loss = correlation_loss(predictions, labels, weight=50.0)
-                l1_loss = l1_regularization(energy_model, 1e-4)
-                var_loss = variability_loss(predictions, alpha=10.0)
-                loss = loss + corr_loss + l1_loss - var_loss
-                zero_penaltyy = zero_penalty_loss(predictions, weight=50.0)
-                loss = loss + zero_penaltyy
-                loss = loss/10.0
-                #print ("preds shape:", predictions.shape)
-                #print ("Predictions: ", predictions.shape)
-                loss.backward()
-                torch.nn.utils.clip_grad_norm_(energy_model.parameters(), max_norm=1.0)
-
-                #corr, corr_loss = correlation_loss(predictions, labels, weight=1.0)
-
-                # Optimize
-                optimizer.step()
-                total_loss += loss.item()
+            # DDP all-reduces gradients only on the last micro-batch of a window
+            with no_sync(forward_model, not stepped):
+                with profiler.stage("forward"):
+                    # Compute energy-based loss
+                    # Only the forward pass runs under autocast; losses, backward and the step stay in float32
+                    with precision.autocast():
+                        #loss, predictions = energy_loss(energy_model, inputs, labels, negative_labels)
+                        predictions = forward_model(to_memory_format(inputs, args.channels_last))
+                    predictions = predictions.float()
+                    loss = criterion(predictions, labels)*(10)
+                    r, corr_loss = correlation_loss(predictions, labels, weight=50.0)
+                    l1_loss = l1_penalty.value() * 10.0  # Detached lambda_l1 * sum(|w|), logged as part of the loss
+                    var_loss = variability_loss(predictions, alpha=10.0)
+                    loss = loss + corr_loss + l1_loss - var_loss
+                    zero_penaltyy = zero_penalty_loss(predictions, weight=50.0)
+                    loss = loss + zero_penaltyy
+                    loss = loss/10.0
+                    #print ("preds shape:", predictions.shape)
+                    #print ("Predictions: ", predictions.shape)
+                with profiler.stage("backward"):
+                    precision.backward(loss / micro_batches)
+
+            #corr, corr_loss = correlation_loss(predictions, labels, weight=1.0)
+
+            if stepped:
+                with profiler.stage("optimizer"):
+                    # Optimize; fp16 gradients are unscaled and the L1 gradient is added before clipping
+                    precision.step(optimizer, energy_model.parameters(), max_norm=1.0, before_clip=l1_penalty.before_clip)
+                    if precision.stepped:  # Nothing to shrink after a skipped fp16 step
+                        l1_penalty.after_step()
+                    scheduler.step()
+            with profiler.stage("logging"):
+                total_loss += loss.detach()
 
                 global_step = epoch * len(data_loader) + batch_idx
-                if batch_idx % log_interval == 0:  # Only log every `log_interval` batches
-                    
-                    writer.add_scalar('Loss/train', loss.item(), epoch * len(data_loader) + batch_idx)
-                    writer.add_scalar('Loss/Correlation Loss', corr_loss.item(), epoch * len(data_loader) + batch_idx)
-                    writer.add_scalar('Loss/Variance Loss', var_loss.item(), epoch * len(data_loader) + batch_idx)
-                    writer.add_scalar('Loss/Zero Loss', zero_penaltyy.item(), epoch * len(data_loader) + batch_idx)
-                    writer.add_scalar('Correlation/overall', r.item(), epoch * len(data_loader) + batch_idx)
-                   
+                if is_main and batch_idx % log_interval == 0:  # Only log every `log_interval` batches
+                
+                    metrics.log_scalars({
+                        'Loss/train': loss,
+                        'Loss/Correlation Loss': corr_loss,
+                        'Loss/Variance Loss': var_loss,
+                        'Loss/Zero Loss': zero_penaltyy,
+                        'Correlation/overall': r,
+                    }, global_step)
+               
                     #log_correlation_per_parameter(writer, epoch * len(data_loader) + batch_idx, predictions, labels, tag="correlation")
-                    log_mse_per_parameter(writer, epoch * len(data_loader) + batch_idx, predictions, labels, tag="mse")
-
-                    for name, param in energy_model.named_parameters():
-                        if param.requires_grad:
-                            # Log gradient norms
-                            if param.grad is not None:
-                                writer.add_scalar(f'Gradients/{name}', param.grad.norm().item(), epoch * len(data_loader) + batch_idx)
-                            
-                            # Log parameter histograms
-                            writer.add_histogram(f'Weights/{name}', param, epoch)
-                print(f"Epoch [{epoch + 1}/{num_epochs}], Batch [{batch_idx + 1}/{len(data_loader)}], Loss: {loss.item():.4f}")
-                if batch_idx > len(data_loader)-100 and batch_idx < len(data_loader)-2:
-                    predictions_unscaled = torch.sign(predictions) * (torch.exp(torch.abs(predictions)) - 1) /100
-                    labels_unscaled = torch.sign(labels) * (torch.exp(torch.abs(labels)) - 1) / 100
-                    predictionsList.append(predictions_unscaled.cpu().detach().numpy())
-                    labs.append(labels_unscaled.cpu().detach().numpy())
-                    #if batch_idx==4:
-                    #    break
-            scheduler.step()
-
-
-        predictions_array = np.concatenate(predictionsList, axis=0)  # Shape: [total_samples, frames, 6]
-        labels_array = np.concatenate(labs, axis=0)  # Shape: [total_samples, frames, 6]
-        # Translation predictions and labels
-        pred_translation = predictions_array[:, 0:3]  # Shape: [total_samples, frames, 3]
-        translation_labels = labels_array[:, 0:3]
-
-        # Rotation predictions and labels
-        pred_rotation = predictions_array[:, 3:]  # Shape: [total_samples, frames, 3]
-        rotation_labels = labels_array[:, 3:]
-        visualize_predicted_vs_actual(pred_translation, translation_labels, pred_rotation, rotation_labels, writer, global_step, label_="Training")
-        avg_loss = total_loss / len(data_loader)
-        print(f"Epoch {epoch+1}/{num_epochs}, Loss: {avg_loss:.4f}")
-
-        # Validation
-        energy_model.eval()
-        with torch.no_grad():
-            val_loss = 0.0
-            predictionsList = []
-            labs = []
-            for val_batch_idx, (inputs, labels) in enumerate(val_loader):
-                labels = labels[:,[1,2,3,4,8,9]] * 100
-                #labels = labels + torch.randn_like(labels) * 0.001
-                inputs, labels = inputs.to(device), labels.to(device)
-                labels = torch.sign(labels) * torch.log1p(torch.abs(labels)) 
-                #negative_labels = generate_negative_samples(labels)
-                inputs = inputs.squeeze(2)#torch.stack(images_stack, dim=0)  # Shape: [frames_per_stack, 1, H, W]
-                inputs = inputs.permute(0, 2, 1, 3, 4)  # Should result in [batch_size, 1, frames_per_stack, H, W]
-                with torch.cuda.amp.autocast():
-                    predictions = energy_model(inputs)
-                loss = criterion(predictions, labels)
-                val_loss += loss.item()
-                predictions_unscaled = torch.sign(predictions) * (torch.exp(torch.abs(predictions)) - 1) / 100
-                labels_unscaled = torch.sign(labels) * (torch.exp(torch.abs(labels)) - 1) /100
-                predictionsList.append(predictions_unscaled.cpu().detach().numpy())
-                labs.append(labels_unscaled.cpu().detach().numpy())
-
-                if val_batch_idx > 60:
-                    break
-
-            predictions_array = np.concatenate(predictionsList, axis=0)  # Shape: [total_samples, frames, 6]
-            labels_array = np.concatenate(labs, axis=0)  # Shape: [total_samples, frames, 6]
-            # Translation predictions and labels
-            pred_translation = predictions_array[:, 0:3]  # Shape: [total_samples, frames, 3]
-            translation_labels = labels_array[:, 0:3]
-
-            # Rotation predictions and labels
-            pred_rotation = predictions_array[:, 3:]  # Shape: [total_samples, frames, 3]
-            rotation_labels = labels_array[:, 3:]
-            visualize_predicted_vs_actual(pred_translation, translation_labels, pred_rotation, rotation_labels, writer, global_step, label_="Validation")
-            avg_val_loss = val_loss / len(val_loader)
-            print(f"Validation Loss: {avg_val_loss:.4f}")
+                    log_mse_per_parameter(metrics, global_step, predictions, labels, tag="mse")
+
+                    # Gradient norms of all parameters in one batched call
+                    metrics.log_grad_norms(energy_model.named_parameters(), global_step)
+                if is_main:
+                    # Parameter histograms every `--histogram-every` global steps
+                    metrics.log_histograms(energy_model.named_parameters(), global_step)
+                    metrics.print("Epoch [{}/{}], Batch [{}/{}], Loss: {:.4f}", epoch + 1, num_epochs, batch_idx + 1, len(data_loader), loss)
+                predictions_unscaled = label_codec.decode(predictions.detach())
+                labels_unscaled = label_codec.decode(labels)
+                train_stats.update(predictions_unscaled, labels_unscaled)
+                train_sample.update(predictions_unscaled, labels_unscaled)
+                #if batch_idx==4:
+                #    break
+                optimizer_step = epoch * steps_per_epoch + batch_idx // accumulate + 1
+                if is_main and stepped and args.checkpoint_every and optimizer_step % args.checkpoint_every == 0 and batch_idx + 1 < len(data_loader):
+                    # Named and stamped with optimizer steps, the unit --checkpoint-every counts
+                    checkpointer.save(training_state(energy_model, optimizer, scheduler, precision, epoch, batch_idx + 1, optimizer_step),
+                                      f'checkpoint_step_{optimizer_step}.pth')
+
+            profiler.step(global_step)
+
+        # Epoch statistics and loss are reduced over the ranks
+        train_stats.all_reduce()
+        avg_loss = all_reduce_mean(total_loss).item() / (len(data_loader) - first_batch)  # Batches run in this epoch
+        # A resumed epoch only saw the batches after the checkpoint; its statistics are logged as partial
+        partial = " (partial)" if first_batch else ""
+        if is_main:
+            # Translation in columns 0:3, rotation in 3:6; fit and R² cover the whole epoch
+            train_stats.log(writer, global_step, prefix=f"Training{partial}/")
+            figures.submit(f"Training{partial}", *train_sample.tensors(), global_step, stats=train_stats.fit())
+            if cache_stats is not None:
+                # Frame cache hits and evictions of this rank's training workers over the epoch
+                scalars = {}
+                for worker, stats in enumerate(cache_stats.epoch_stats()):
+                    scalars[f'FrameCache/worker {worker} hit rate'] = stats['hit_rate']
+                    scalars[f'FrameCache/worker {worker} evictions'] = stats['evictions']
+                metrics.log_scalars(scalars, global_step)
+            metrics.flush()  # Let the queued batch lines print before the epoch summary
+            if first_batch:
+                print(f"Epoch {epoch+1}/{num_epochs} (partial, batches {first_batch + 1}-{len(data_loader)} after resuming), Loss: {avg_loss:.4f}")
+            else:
+                print(f"Epoch {epoch+1}/{num_epochs}, Loss: {avg_loss:.4f}")
+            if args.profile:
+                print(profiler.summary(global_step))
+
+        # Validation on every held-out window, under inference_mode, with the BatchNorm statistics that get saved
+        broadcast_buffers(energy_model)
+        val_stats.reset()
+        val_sample.reset()
+        val_result = evaluate(eval_model, val_loader, device, criterion, label_codec=label_codec, precision=precision,
+                              channels_last=args.channels_last, stats=val_stats, sample=val_sample)
+        avg_val_loss = val_result["loss"]  # Over all ranks
+        if is_main:
+            val_stats.log(writer, global_step, prefix="Validation/")
+            figures.submit("Validation", *val_sample.tensors(), global_step, stats=val_stats.fit())
+            print(f"Validation Loss: {avg_val_loss:.4f} ({val_result['samples_per_s']:.1f} samples/s)")
             writer.add_scalar('Loss/Avg Validation', avg_val_loss, epoch * len(data_loader) + batch_idx)
-        model_save_path = f'Resnet_models/model_epoch_{epoch + 1}.pth'
-        torch.save(energy_model.state_dict(), model_save_path)
+            writer.add_scalar('Throughput/Validation samples per s', val_result['samples_per_s'], global_step)
+            checkpointer.save(training_state(energy_model, optimizer, scheduler, precision, epoch + 1, 0, (epoch + 1) * steps_per_epoch),
+                              f'model_epoch_{epoch + 1}.pth', metric=avg_val_loss)
+    profiler.close()
+    if is_main:
+        metrics.close()
+        figures.close()
+        checkpointer.close()
+    cleanup()
         
\ No newline at end of file
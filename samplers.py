@@ -0,0 +1,138 @@
+"""
+Locality-aware sampling for StackedFramesDataset.
+
+Neighbouring windows of a sequence share all but one frame. Shuffling whole
+contiguous chunks of windows instead of single windows, and pinning each chunk to
+one DataLoader worker, lets the per-worker frame cache and OS readahead reuse
+decoded frames while keeping epoch-level ordering close to a full shuffle.
+"""
+import math
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+def ranges_from_indices(indices, offsets):
+    """
+    Collapse flat window indices into contiguous runs.
+
+    Args:
+        indices: Flat StackedFramesDataset indices, in any order.
+        offsets: Cumulative window offsets of the dataset (`dataset.sequence_offsets`).
+            Runs never cross from one sequence into the next.
+
+    Returns:
+        np.ndarray: int64 array of shape [num_runs, 2] with [start, stop) rows.
+    """
+    idx = np.unique(np.asarray(indices, dtype=np.int64))
+    if len(idx) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    seq = np.searchsorted(offsets, idx, side='right') - 1
+    breaks = np.flatnonzero((np.diff(idx) != 1) | (np.diff(seq) != 0)) + 1
+    starts = idx[np.concatenate(([0], breaks))]
+    stops = idx[np.concatenate((breaks - 1, [len(idx) - 1]))] + 1
+    return np.stack([starts, stops], axis=1)
+
+
+def split_ranges(ranges, chunk_size):
+    """Cut [start, stop) runs into chunks of at most `chunk_size` windows."""
+    chunks = []
+    for start, stop in np.asarray(ranges, dtype=np.int64).reshape(-1, 2):
+        bounds = np.arange(start, stop, chunk_size)
+        chunks.append(np.stack([bounds, np.minimum(bounds + chunk_size, stop)], axis=1))
+    if not chunks:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+class ChunkedShuffleBatchSampler(Sampler):
+    """
+    Batch sampler that shuffles contiguous chunks of windows and keeps each chunk on one worker.
+
+    Every epoch the chunks are permuted and the windows inside a chunk are optionally
+    shuffled. The resulting stream is cut into batches, consecutive batches are grouped
+    into runs that cover about one chunk, and runs are dealt round-robin to one lane
+    per worker. Batches are emitted interleaved across lanes, which matches the
+    round-robin order in which the DataLoader hands batches to its workers, so all
+    batches of a run are loaded by the same worker.
+
+    Args:
+        ranges: [start, stop) runs of dataset indices to sample from, e.g. from
+            `ranges_from_indices`.
+        batch_size (int): Samples per batch.
+        chunk_size (int): Windows per chunk. 1 degenerates to a full shuffle.
+        num_workers (int): DataLoader workers the lanes should line up with.
+        shuffle_within_chunk (bool): Shuffle windows inside each chunk.
+        drop_last (bool): Drop the last incomplete batch.
+        seed (int): Base seed; the permutation of epoch e uses (seed, e).
+        num_replicas (int): Distributed ranks sharing the epoch.
+        rank (int): Rank of this process; it gets a contiguous slice of the permuted windows.
+
+    Every rank computes the same permutation and takes its own slice of it. The window
+    stream wraps around so that all ranks get the same number of batches, as DDP requires.
+    The batch order of an epoch depends only on (seed, epoch), so a run resumed with
+    `set_epoch(epoch, start_batch)` sees exactly the batches it had not trained on yet.
+    """
+
+    def __init__(self, ranges, batch_size, chunk_size=64, num_workers=0, shuffle_within_chunk=True,
+                 drop_last=False, seed=0, num_replicas=1, rank=0):
+        self.ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
+        self.shuffle_within_chunk = shuffle_within_chunk
+        self.drop_last = drop_last
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start_batch = 0
+        self.chunks = split_ranges(self.ranges, chunk_size)
+        self.total_samples = int((self.ranges[:, 1] - self.ranges[:, 0]).sum())
+        self.num_samples = math.ceil(self.total_samples / num_replicas)  # Windows per rank
+
+    def set_epoch(self, epoch, start_batch=0):
+        """Select the permutation of `epoch`; the next iteration skips its first `start_batch` batches."""
+        self.epoch = epoch
+        self.start_batch = start_batch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return math.ceil(self.num_samples / self.batch_size)
+
+    def _window_stream(self, rng):
+        order = rng.permutation(len(self.chunks))
+        pieces = []
+        for start, stop in self.chunks[order]:
+            windows = np.arange(start, stop)
+            if self.shuffle_within_chunk:
+                rng.shuffle(windows)
+            pieces.append(windows)
+        return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.int64)
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        stream = self._window_stream(rng)
+        if self.num_replicas > 1 and len(stream):
+            # Contiguous slice per rank keeps chunks together; wrap around to even out the ranks
+            stream = np.resize(stream, self.num_samples * self.num_replicas)
+            stream = stream[self.rank * self.num_samples:(self.rank + 1) * self.num_samples]
+        num_batches = len(self)
+        batches = [stream[i * self.batch_size:(i + 1) * self.batch_size].tolist() for i in range(num_batches)]
+
+        lanes = max(self.num_workers, 1)
+        batches_per_run = max(1, math.ceil(self.chunk_size / self.batch_size))
+        lane_batches = [[] for _ in range(lanes)]
+        for run_idx, run_start in enumerate(range(0, num_batches, batches_per_run)):
+            lane_batches[run_idx % lanes].extend(batches[run_start:run_start + batches_per_run])
+
+        # Interleave lanes so batch k goes to worker k % num_workers
+        emitted = 0
+        for position in range(max(len(lane) for lane in lane_batches)):
+            for lane in lane_batches:
+                if position < len(lane):
+                    # Batches a resumed epoch already trained on are skipped
+                    if emitted >= self.start_batch:
+                        yield lane[position]
+                    emitted += 1
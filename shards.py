@@ -0,0 +1,228 @@
+"""
+Sharded sequential-record format for the training frames, and a streaming dataset.
+
+Random access to millions of small JPEGs is slow on network or spinning storage. The
+export step decodes every subject/sequence folder once and appends whole sequences to
+large tar shards, so training reads a few big files front to back:
+
+    <shard_dir>/shard-00000.tar
+        <subject>/<sequence>/frames.npy   uint8 [num_frames, H, W] grayscale
+        <subject>/<sequence>/labels.npy   float64 [num_frames, num_columns]
+    <shard_dir>/index.json                sequences and window counts per shard
+
+ShardedStackDataset streams the shards, splits them across DataLoader workers and
+distributed ranks, and mixes windows from different sequences with a shuffle buffer.
+It yields the same samples as StackedFramesDataset. The training scripts do not use it
+yet; it is a standalone reader.
+
+Usage:
+    python shards.py TrainingData2/ TrainingData2_shards/ --shard-mb 1024
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import tarfile
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+from collate import INPUT_SCALE
+from label_codec import window_medians
+from manifest import default_manifest_path, scan_sequences
+
+INDEX_NAME = "index.json"
+
+
+def _add_array(tar, name, array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    info = tarfile.TarInfo(name)
+    info.size = buffer.tell()
+    buffer.seek(0)
+    tar.addfile(info, buffer)
+
+
+def export_shards(root_dir, shard_dir, shard_bytes=1 << 30, frames_per_stack=20):
+    """
+    Write every sequence of `root_dir` into tar shards of about `shard_bytes` each.
+
+    A sequence is never split across shards.
+
+    Returns:
+        list: Paths of the written shards.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    index = {"frames_per_stack": frames_per_stack, "shards": []}
+    tar, shard, shard_size = None, None, 0
+
+    for sequence_path, frame_names, labels in scan_sequences(root_dir, default_manifest_path(root_dir)):
+        if len(frame_names) != len(labels):
+            print(f"Mismatch in frames ({len(frame_names)}) and labels ({len(labels)}) in {sequence_path}.")
+            continue
+        frames = np.stack([np.asarray(Image.open(os.path.join(sequence_path, f)).convert("L")) for f in frame_names])
+        if tar is None or shard_size + frames.nbytes > shard_bytes:
+            if tar is not None:
+                tar.close()
+            shard = {"path": f"shard-{len(index['shards']):05d}.tar", "sequences": [], "windows": 0}
+            index["shards"].append(shard)
+            tar = tarfile.open(os.path.join(shard_dir, shard["path"]), "w")
+            shard_size = 0
+            print("Writing shard: ", shard["path"])
+
+        key = os.path.relpath(sequence_path, root_dir).replace(os.sep, "/")
+        _add_array(tar, f"{key}/frames.npy", frames)
+        _add_array(tar, f"{key}/labels.npy", labels)
+        shard_size += frames.nbytes + labels.nbytes
+        shard["sequences"].append(key)
+        shard["windows"] += max(len(frames) - frames_per_stack, 0)
+
+    if tar is not None:
+        tar.close()
+    with open(os.path.join(shard_dir, INDEX_NAME), "w") as f:
+        json.dump(index, f, indent=1)
+    return [os.path.join(shard_dir, shard["path"]) for shard in index["shards"]]
+
+
+def read_shard(path):
+    """Stream (key, frames, labels) for each sequence of a shard, reading it sequentially."""
+    arrays = {}
+    with tarfile.open(path, mode="r|") as tar:
+        for member in tar:
+            key, name = member.name.rsplit("/", 1)
+            arrays[name] = np.load(io.BytesIO(tar.extractfile(member).read()))
+            if "frames.npy" in arrays and "labels.npy" in arrays:
+                yield key, arrays.pop("frames.npy"), arrays.pop("labels.npy")
+
+
+def _read_shards(paths):
+    for path in paths:
+        yield from read_shard(path)
+
+
+class ShardedStackDataset(IterableDataset):
+    """
+    Stream windows of `frames_per_stack` frames from tar shards written by `export_shards`.
+
+    Shards are permuted every epoch and dealt to the (rank, worker) pairs, each to the
+    pair with the fewest windows so far, so each shard is read once per epoch by exactly
+    one worker. Under torch.distributed, every pair then stops after the window count
+    of the smallest pair. All ranks then yield the same number of windows and batches,
+    and no rank waits in the gradient all-reduce for a rank that has run out. The
+    windows past that count are skipped for the epoch; the next permutation deals the
+    shards differently. Windows go through a shuffle buffer of (sequence, start)
+    references; frames are only converted to tensors when a window leaves the buffer.
+
+    Args:
+        shard_dir (str): Folder written by `export_shards`.
+        frames_per_stack (int): Window length.
+        transform: Optional per-frame transform, as in StackedFramesDataset.
+        label_codec: Optional LabelCodec applied to the window medians.
+        shuffle_buffer (int): Windows held for shuffling (0 streams in order).
+        seed (int): Base seed; epoch e uses (seed, e).
+        as_uint8 (bool): Without a transform, yield raw uint8 [T, H, W] stacks for stack_collate.
+    """
+
+    def __init__(self, shard_dir, frames_per_stack=20, transform=None, label_codec=None, shuffle_buffer=10000, seed=0,
+                 as_uint8=False):
+        with open(os.path.join(shard_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+        if index.get("frames_per_stack", frames_per_stack) != frames_per_stack:
+            raise ValueError(f"Shards in {shard_dir} were exported with frames_per_stack={index['frames_per_stack']}, "
+                             f"not {frames_per_stack}; their window counts would not match.")
+        self.shards = [os.path.join(shard_dir, shard["path"]) for shard in index["shards"]]
+        self.shard_windows = [shard["windows"] for shard in index["shards"]]
+        self.num_windows = sum(self.shard_windows)
+        self.frames_per_stack = frames_per_stack
+        self.transform = transform
+        self.label_codec = label_codec
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.as_uint8 = as_uint8
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _assigned_shards(self, rng):
+        """
+        Shards of this (rank, worker) pair, and the number of windows it may yield
+        (None outside torch.distributed).
+        """
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        num_slots = world_size * num_workers
+        if world_size > 1 and len(self.shards) < num_slots:
+            raise ValueError(f"{len(self.shards)} shards cannot be split evenly over {world_size} ranks x {num_workers} workers; "
+                             f"export smaller shards (--shard-mb) or use fewer workers.")
+        # Every rank and worker draws the same permutation and computes the same assignment
+        loads = np.zeros(num_slots, dtype=np.int64)
+        assigned = [[] for _ in range(num_slots)]
+        for i in rng.permutation(len(self.shards)):
+            slot = int(np.argmin(loads))
+            assigned[slot].append(self.shards[i])
+            loads[slot] += self.shard_windows[i]
+        limit = int(loads.min()) if world_size > 1 else None
+        return assigned[rank * num_workers + worker_id], limit
+
+    def _windows(self, shards):
+        for _, frames, labels in _read_shards(shards):
+            targets = window_medians(labels, self.frames_per_stack)
+            if self.label_codec is not None:
+                targets = self.label_codec.encode(targets).astype(np.float32)
+            for start in range(len(targets)):
+                yield frames, start, targets
+
+    def _sample(self, frames, start, targets):
+        stack_pixels = frames[start:start + self.frames_per_stack]
+        if not self.transform and self.as_uint8:
+            images_stack = torch.from_numpy(np.array(stack_pixels))
+        elif not self.transform:
+            images_stack = torch.from_numpy(stack_pixels.astype(np.float32) * INPUT_SCALE).unsqueeze(1)
+        else:
+            images = []
+            for pixels in stack_pixels:
+                image = self.transform(Image.fromarray(pixels))
+                images.append(torch.from_numpy(np.array(image, dtype=np.float32) / 255.0).unsqueeze(0))
+            images_stack = torch.stack(images, dim=0)
+        return images_stack, torch.from_numpy(targets[start])
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        shards, limit = self._assigned_shards(rng)
+        windows = itertools.islice(self._windows(shards), limit)
+        if self.shuffle_buffer <= 0:
+            for window in windows:
+                yield self._sample(*window)
+            return
+
+        buffer = []
+        for window in windows:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(window)
+                continue
+            slot = rng.integers(len(buffer))
+            yield self._sample(*buffer[slot])
+            buffer[slot] = window
+        rng.shuffle(buffer)
+        for window in buffer:
+            yield self._sample(*window)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root_dir", help="Source tree (subject/sequence/frames + labels.csv)")
+    parser.add_argument("shard_dir", help="Where to write the shards")
+    parser.add_argument("--shard-mb", type=float, default=1024, help="Target shard size in MB")
+    parser.add_argument("--frames-per-stack", type=int, default=20)
+    args = parser.parse_args()
+
+    shards = export_shards(args.root_dir, args.shard_dir, int(args.shard_mb * 2**20), args.frames_per_stack)
+    print(f"Wrote {len(shards)} shards to {args.shard_dir}.")
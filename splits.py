@@ -0,0 +1,92 @@
+"""
+Train/validation splits of StackedFramesDataset stored as index ranges.
+
+Neighbouring windows of a sequence overlap in all but one frame, so splitting
+individual windows puts near-duplicates of every validation sample into the training
+set. These helpers assign whole sequences (or whole subjects) to one side and describe
+each side as [start, stop) runs of window indices, so the split costs a few bytes per
+sequence instead of one Python int per window.
+"""
+import numpy as np
+from torch.utils.data import Dataset
+
+
+def group_split(groups, offsets, val_fraction=0.1, seed=0):
+    """
+    Split sequences into train and validation by group.
+
+    Groups are visited in a random order and moved to validation until it holds at
+    least `val_fraction` of the windows. At least one group stays in training.
+
+    Args:
+        groups (list): Group key of every sequence (e.g. its subject).
+        offsets (np.ndarray): Cumulative window offsets (`dataset.sequence_offsets`).
+        val_fraction (float): Target fraction of windows in validation.
+        seed (int): Seed of the group order.
+
+    Returns:
+        tuple: (train_ranges, val_ranges), int64 arrays of [start, stop) rows, one per
+            non-empty sequence.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keys, group_ids = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True)
+    windows = np.bincount(group_ids, weights=np.diff(offsets), minlength=len(keys))
+
+    order = np.random.default_rng(seed).permutation(len(keys))
+    target = val_fraction * offsets[-1]
+    val_groups = np.zeros(len(keys), dtype=bool)
+    val_windows = 0
+    for group in order[:-1]:
+        if val_windows >= target or target <= 0:
+            break
+        val_groups[group] = True
+        val_windows += windows[group]
+
+    ranges = np.stack([offsets[:-1], offsets[1:]], axis=1)
+    non_empty = ranges[:, 1] > ranges[:, 0]
+    in_val = val_groups[group_ids]
+    return ranges[non_empty & ~in_val], ranges[non_empty & in_val]
+
+
+def shard_ranges(ranges, num_replicas, rank):
+    """
+    Contiguous share of [start, stop) runs for one of `num_replicas` ranks.
+
+    Windows are divided as evenly as possible without padding, so every window is
+    evaluated by exactly one rank.
+    """
+    ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+    offsets = np.concatenate(([0], np.cumsum(ranges[:, 1] - ranges[:, 0])))
+    total = int(offsets[-1])
+    begin, end = total * rank // num_replicas, total * (rank + 1) // num_replicas
+    starts = ranges[:, 0] + np.clip(begin - offsets[:-1], 0, None)
+    stops = ranges[:, 0] + np.minimum(end - offsets[:-1], ranges[:, 1] - ranges[:, 0])
+    keep = stops > starts
+    return np.stack([starts[keep], stops[keep]], axis=1)
+
+
+class RangeSubset(Dataset):
+    """
+    Subset of a dataset given as [start, stop) runs of indices.
+
+    Args:
+        dataset: Dataset to index into.
+        ranges: int array of shape [num_runs, 2].
+    """
+
+    def __init__(self, dataset, ranges):
+        self.dataset = dataset
+        self.ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+        self._offsets = np.zeros(len(self.ranges) + 1, dtype=np.int64)
+        np.cumsum(self.ranges[:, 1] - self.ranges[:, 0], out=self._offsets[1:])
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("Index out of range.")
+        run = int(np.searchsorted(self._offsets, idx, side='right')) - 1
+        return self.dataset[int(self.ranges[run, 0] + idx - self._offsets[run])]
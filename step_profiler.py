@@ -0,0 +1,184 @@
+"""
+Opt-in per-stage timing of the training loop, and a torch.profiler trace of a few steps.
+
+A slow epoch can wait on the DataLoader workers, on decoding, on the logging block or on
+compute. `StepProfiler` splits each step's wall time into stages:
+- "data": waiting for the next batch from the DataLoader (`iterate`).
+- "h2d": batched augmentation and the host-to-device copy.
+- "forward", "backward", "optimizer": compute.
+- "logging": metrics, statistics and checkpoint bookkeeping.
+- "other": whatever the stages do not cover.
+
+On CUDA the device is synchronized at every stage boundary, so queued kernels are
+charged to the stage that launched them. This removes the usual overlap, so a profiled
+epoch runs somewhat slower than a normal one. Mean milliseconds per stage go to
+TensorBoard under Profile/ every `log_every` steps, and a summary table at every
+`summary()`.
+
+For `trace_steps` steps after the first `trace_start`, torch.profiler also records
+operator-level activity, with the stages as labelled ranges. The trace is written to
+`log_dir` (the TensorBoard run directory) for the profiler plugin, or chrome://tracing.
+The top operators are written to `log_dir`/profile_ops.txt and as TensorBoard text.
+
+When disabled, `stage` returns a shared null context and `iterate` returns the loader
+itself, so the loop pays one attribute lookup and call per stage.
+
+    profiler = StepProfiler(args.profile, device, writer, writer.get_logdir())
+    for inputs, labels in profiler.iterate(data_loader):
+        with profiler.stage("forward"):
+            ...
+        profiler.step(global_step)
+    profiler.close()
+"""
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import torch
+from torch.profiler import ProfilerActivity, profile, record_function, schedule, tensorboard_trace_handler
+
+STAGES = ("data", "h2d", "forward", "backward", "optimizer", "logging")
+_NULL = nullcontext()
+
+
+class StepProfiler:
+    """
+    Per-stage wall time of training steps, plus an optional torch.profiler window.
+
+    Args:
+        enabled (bool): Off makes every method a no-op.
+        device (torch.device): Training device; CUDA is synchronized at stage boundaries.
+        writer: SummaryWriter for Profile/ scalars and summaries, or None.
+        log_dir (str): Where traces and the operator table are written (None disables them).
+        trace_start (int): Steps to skip before the trace window.
+        trace_steps (int): Steps recorded by torch.profiler (0 disables the trace).
+        log_every (int): Steps between Profile/ scalars.
+    """
+
+    def __init__(self, enabled, device, writer=None, log_dir=None, trace_start=10, trace_steps=5, log_every=25):
+        self.enabled = enabled
+        if not enabled:
+            return
+        self.device = torch.device(device)
+        self.writer = writer
+        self.log_dir = log_dir
+        self.log_every = log_every
+        self._current = defaultdict(float)  # Stage seconds of the step in progress
+        self._window = defaultdict(float)  # Since the last Profile/ scalars
+        self._totals = defaultdict(float)  # Since the last summary
+        self._window_steps = self._total_steps = 0
+        self._step_start = time.perf_counter()
+
+        self._profiler = None
+        if log_dir is not None and trace_steps > 0:
+            activities = [ProfilerActivity.CPU]
+            if self.device.type == "cuda":
+                activities.append(ProfilerActivity.CUDA)
+            self._profiler = profile(
+                activities=activities,
+                schedule=schedule(skip_first=trace_start, wait=0, warmup=1, active=trace_steps, repeat=1),
+                on_trace_ready=self._trace_ready,
+                profile_memory=True,
+            )
+            self._profiler.start()
+
+    def _sync(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    @contextmanager
+    def _timed(self, name):
+        self._sync()
+        start = time.perf_counter()
+        with record_function(name):
+            yield
+            self._sync()
+        self._current[name] += time.perf_counter() - start
+
+    def stage(self, name):
+        """Context that charges its wall time to stage `name`."""
+        if not self.enabled:
+            return _NULL
+        return self._timed(name)
+
+    def iterate(self, loader):
+        """`loader`, with the wait for each batch charged to the "data" stage."""
+        if not self.enabled:
+            return loader
+        return self._iterate(loader)
+
+    def _iterate(self, loader):
+        # Work between epochs (validation, checkpoints) is not charged to the first step
+        self._step_start = time.perf_counter()
+        iterator = None
+        while True:
+            with self._timed("data"):
+                try:
+                    if iterator is None:
+                        iterator = iter(loader)  # Worker startup counts as waiting for data
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+            yield batch
+
+    def step(self, global_step):
+        """End the current step: record its stages and advance the trace window."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._current["other"] = max(now - self._step_start - sum(self._current.values()), 0.0)
+        self._current["step"] = now - self._step_start
+        for name, seconds in self._current.items():
+            self._window[name] += seconds
+            self._totals[name] += seconds
+        self._current.clear()
+        self._window_steps += 1
+        self._total_steps += 1
+        if self._profiler is not None:
+            self._profiler.step()
+
+        if self.writer is not None and self._window_steps >= self.log_every:
+            for name, seconds in self._window.items():
+                self.writer.add_scalar(f"Profile/{name} ms", seconds / self._window_steps * 1e3, global_step)
+            self._window.clear()
+            self._window_steps = 0
+        self._step_start = time.perf_counter()
+
+    def summary(self, global_step=None, reset=True):
+        """
+        Table of mean milliseconds and share of the step per stage since the last summary;
+        also written to TensorBoard as text when `global_step` is given.
+        """
+        if not self.enabled or self._total_steps == 0:
+            return ""
+        step_seconds = self._totals["step"]
+        lines = [f"{'stage':<10} {'ms/step':>9} {'share':>6}"]
+        for name in STAGES + ("other",):
+            seconds = self._totals.get(name, 0.0)
+            lines.append(f"{name:<10} {seconds / self._total_steps * 1e3:>9.2f} {seconds / step_seconds:>6.1%}")
+        lines.append(f"{'step':<10} {step_seconds / self._total_steps * 1e3:>9.2f} over {self._total_steps} steps")
+        table = "\n".join(lines)
+        if self.writer is not None and global_step is not None:
+            self.writer.add_text("Profile/stages", f"<pre>{table}</pre>", global_step)
+        if reset:
+            self._totals.clear()
+            self._total_steps = 0
+        # Time spent summarizing is not charged to the next step
+        self._step_start = time.perf_counter()
+        return table
+
+    def _trace_ready(self, prof):
+        tensorboard_trace_handler(self.log_dir)(prof)
+        sort_by = "self_cuda_time_total" if self.device.type == "cuda" else "self_cpu_time_total"
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=40)
+        with open(os.path.join(self.log_dir, "profile_ops.txt"), "w") as f:
+            f.write(table)
+        if self.writer is not None:
+            self.writer.add_text("Profile/operators", f"<pre>{table}</pre>", prof.step_num)
+        print(f"Profiler trace written to {self.log_dir}")
+
+    def close(self):
+        if self.enabled and self._profiler is not None:
+            self._profiler.stop()
+            self._profiler = None
@@ -0,0 +1,170 @@
+"""
+On-device running statistics for predictions against labels.
+
+Validation used to stop after 62 batches and keep every prediction in a list, and
+training kept its last ~100 batches the same way, so MSE, correlation and R² were
+computed on a truncated sample with memory growing per batch. `RegressionAccumulator`
+merges each batch into per-column running means, co-moments and squared error with the
+parallel Welford update of Chan et al. It covers any number of batches in O(1) memory
+and never leaves the device. `ReservoirSample` keeps a fixed-size uniform sample of
+(prediction, label) rows for the scatter plots.
+"""
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+class RegressionAccumulator:
+    """
+    Running per-column MSE, Pearson correlation, least-squares fit and R².
+
+    The fit regresses predictions on labels (prediction ~ slope * label + intercept), and
+    R² is sklearn's r2_score(labels, predictions), as in the predicted-vs-actual figures.
+
+    Args:
+        num_outputs (int): Number of columns.
+        device: Device the statistics live on.
+    """
+
+    def __init__(self, num_outputs, device="cpu"):
+        self.num_outputs = num_outputs
+        self.device = torch.device(device)
+        self.reset()
+
+    def reset(self):
+        zeros = lambda: torch.zeros(self.num_outputs, dtype=torch.float64, device=self.device)
+        self.count = 0  # Host integer: batch sizes are known without a sync
+        self.label_mean, self.prediction_mean = zeros(), zeros()
+        self.label_m2, self.prediction_m2, self.comoment = zeros(), zeros(), zeros()
+        self.squared_error = zeros()
+
+    @torch.no_grad()
+    def update(self, predictions, labels):
+        """Merge a batch of [B, num_outputs] predictions and labels."""
+        predictions = predictions.detach().reshape(-1, self.num_outputs).to(self.device, torch.float64)
+        labels = labels.detach().reshape(-1, self.num_outputs).to(self.device, torch.float64)
+        batch = len(labels)
+        if batch == 0:
+            return
+        batch_label_mean, batch_prediction_mean = labels.mean(dim=0), predictions.mean(dim=0)
+        label_centered = labels - batch_label_mean
+        prediction_centered = predictions - batch_prediction_mean
+        self._merge(batch, batch_label_mean, batch_prediction_mean, (label_centered ** 2).sum(dim=0),
+                    (prediction_centered ** 2).sum(dim=0), (label_centered * prediction_centered).sum(dim=0),
+                    ((predictions - labels) ** 2).sum(dim=0))
+
+    def _merge(self, batch, batch_label_mean, batch_prediction_mean, label_m2, prediction_m2, comoment, squared_error):
+        total = self.count + batch
+        label_delta = batch_label_mean - self.label_mean
+        prediction_delta = batch_prediction_mean - self.prediction_mean
+        weight = self.count * batch / total
+        self.label_m2 += label_m2 + label_delta ** 2 * weight
+        self.prediction_m2 += prediction_m2 + prediction_delta ** 2 * weight
+        self.comoment += comoment + label_delta * prediction_delta * weight
+        self.label_mean += label_delta * (batch / total)
+        self.prediction_mean += prediction_delta * (batch / total)
+        self.squared_error += squared_error
+        self.count = total
+
+    @torch.no_grad()
+    def all_reduce(self):
+        """Merge the statistics of all torch.distributed ranks into every rank (no-op in a single process)."""
+        if not (dist.is_available() and dist.is_initialized()) or dist.get_world_size() == 1:
+            return
+        local = torch.stack([torch.full_like(self.label_mean, float(self.count)), self.label_mean, self.prediction_mean,
+                             self.label_m2, self.prediction_m2, self.comoment, self.squared_error])
+        gathered = [torch.empty_like(local) for _ in range(dist.get_world_size())]
+        dist.all_gather(gathered, local)
+        self.reset()
+        for count, *moments in torch.stack(gathered).unbind(0):
+            count = int(count[0].item())
+            if count > 0:
+                self._merge(count, *moments)
+
+    @torch.no_grad()
+    def compute(self):
+        """
+        Returns:
+            dict: "mse", "correlation", "slope", "intercept", "r2" -> float64 tensors [num_outputs]
+                on the accumulator's device.
+        """
+        count = max(self.count, 1)
+        tiny = torch.finfo(torch.float64).tiny
+        varies = self.label_m2 > 0
+        slope = torch.where(varies, self.comoment / self.label_m2.clamp_min(tiny), torch.zeros_like(self.comoment))
+        # Constant labels: R² is 1 for a perfect fit and 0 otherwise, as in sklearn
+        perfect = (self.squared_error == 0).double()
+        return {
+            "mse": self.squared_error / count,
+            "correlation": self.comoment / (self.label_m2 * self.prediction_m2).sqrt().clamp_min(tiny),
+            "slope": slope,
+            "intercept": self.prediction_mean - slope * self.label_mean,
+            "r2": torch.where(varies, 1.0 - self.squared_error / self.label_m2.clamp_min(tiny), perfect),
+        }
+
+    def fit(self):
+        """(slope, intercept, r2) of the predicted-vs-actual fit, for FigureWorker.submit."""
+        stats = self.compute()
+        return stats["slope"], stats["intercept"], stats["r2"]
+
+    def log(self, writer, step, prefix=""):
+        """Write every statistic as "<prefix><name>/param_<i>" scalars."""
+        if self.count == 0:
+            return
+        for name, values in self.compute().items():
+            for param_idx, value in enumerate(values.tolist()):
+                writer.add_scalar(f"{prefix}{name}/param_{param_idx}", value, step)
+
+
+class ReservoirSample:
+    """
+    Uniform sample of at most `capacity` (prediction, label) rows from a stream of batches.
+
+    Replacement positions are drawn on the host (Algorithm R), and the rows are
+    written on the device.
+
+    Args:
+        capacity (int): Rows to keep.
+        seed (int): Seed of the sampling.
+    """
+
+    def __init__(self, capacity, seed=0):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self.seen = 0
+        self.predictions = None
+        self.labels = None
+
+    @torch.no_grad()
+    def update(self, predictions, labels):
+        predictions = predictions.detach().reshape(len(predictions), -1)
+        labels = labels.detach().reshape(len(labels), -1)
+        if self.predictions is None:
+            self.predictions = predictions.new_empty((self.capacity, predictions.shape[1]))
+            self.labels = labels.new_empty((self.capacity, labels.shape[1]))
+
+        # Row k of the stream (0-based) replaces slot j ~ U{0..k} if j < capacity
+        positions = self.seen + np.arange(len(labels))
+        slots = np.where(positions < self.capacity, positions,
+                         np.floor(self.rng.random(len(labels)) * (positions + 1)).astype(np.int64))
+        keep = slots < self.capacity
+        # When a batch hits the same slot twice, the later row wins
+        slots, rows = slots[keep][::-1], np.flatnonzero(keep)[::-1]
+        slots, first = np.unique(slots, return_index=True)
+        rows = rows[first]
+        if len(rows):
+            slot_index = torch.from_numpy(slots).to(self.predictions.device)
+            row_index = torch.from_numpy(rows.copy()).to(predictions.device)
+            self.predictions[slot_index] = predictions[row_index]
+            self.labels[slot_index] = labels[row_index]
+        self.seen += len(labels)
+
+    def tensors(self):
+        """(predictions, labels) of the sampled rows."""
+        size = min(self.seen, self.capacity)
+        if self.predictions is None:
+            return None, None
+        return self.predictions[:size], self.labels[:size]